@@ -0,0 +1,142 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# Post-workout analytics over the samples of a logged session
+#
+# The columns of the session log are mapped, without copying, into NumPy arrays
+# and all the metrics are computed with vectorized operations.
+#
+#    python3 Analytics.py [log directory]
+#        Reprocess all the logged sessions and print their summary
+#
+
+import sys
+import time
+
+import numpy as np
+
+import History
+import Logbook
+import User
+
+
+splitDistance = History.splitDistance
+
+# Stroke rate zones, in strokes/min
+strokeRateZones = np.array([18, 22, 26, 30, 34])
+
+# Heart rate zones, as a fraction of the maximum heart rate
+heartRateZones = np.array([0.5, 0.6, 0.7, 0.8, 0.9])
+
+
+#
+# Concept2 pace-to-power formula: watts = 2.80 / (secs per meter)^3
+#
+def watts(paceSecsPer500m):
+    return 2.80 / (paceSecsPer500m / splitDistance) ** 3
+
+
+#
+# Time spent in each zone (in secs), weighted by the time between samples
+#
+def timeInZones(values, zones, dt, valid):
+    idx = np.digitize(values[valid], zones)
+    return np.bincount(idx, weights=dt[valid], minlength=len(zones) + 1)
+
+
+def analyzeColumns(columns):
+    # The PM-5 counters restart with each phase: made monotonic the same way as in the history index
+    times     = np.array(History.accumulate(columns['ElapsedTime']), dtype=np.float64) / 100
+    distances = np.array(History.accumulate(columns['Distance']),    dtype=np.float64) / 10
+    strokes   = np.frombuffer(columns['StrokeRate'], dtype=np.uint8)
+    beats     = np.frombuffer(columns['HeartBPM'],   dtype=np.uint8)
+    pace      = np.frombuffer(columns['Pace'],       dtype=np.uint16) / 100
+
+    result = {'samples': len(times), 'totalTime': 0.0, 'totalDistance': 0.0}
+    if len(times) < 2:
+        return result
+
+    result['totalTime']     = float(times[-1])
+    result['totalDistance'] = float(distances[-1])
+
+    # Weight of each sample: the time until the next one
+    dt = np.diff(times, append=times[-1])
+
+    # Splits: time to cover each 500m, interpolated between samples
+    marks = np.arange(splitDistance, distances[-1] + 1e-9, splitDistance)
+    markTimes = np.interp(marks, distances, times)
+    result['splits'] = np.diff(markTimes, prepend=0.0).tolist()
+
+    rowing = pace > 0
+    if np.any(rowing):
+        p = pace[rowing]
+        w = dt[rowing]
+        total = w.sum()
+        if total > 0:
+            power = watts(p)
+            result['avgPace']         = float(np.average(p, weights=w))
+            result['paceVariability'] = float(p.std() / p.mean())
+            result['avgWatts']        = float(np.average(power, weights=w))
+            result['maxWatts']        = float(power.max())
+        # Pace drift, in secs/500m per minute of rowing
+        if len(p) > 1 and np.ptp(times[rowing]) > 0:
+            result['paceDrift'] = float(np.polyfit(times[rowing] / 60, p, 1)[0])
+
+    result['strokeRateZones'] = timeInZones(strokes, strokeRateZones, dt, strokes > 0).tolist()
+
+    valid = (beats > 0) & (beats < 255)
+    result['heartRateZones'] = timeInZones(beats, heartRateZones * User.maxHeartRate, dt, valid).tolist()
+    if np.any(valid):
+        result['avgHeartRate'] = float(np.average(beats[valid], weights=dt[valid] + 1e-9))
+        # Cardiac drift, in bpm per minute
+        if np.ptp(times[valid]) > 0:
+            result['heartRateDrift'] = float(np.polyfit(times[valid] / 60, beats[valid], 1)[0])
+
+    return result
+
+
+#
+# Analyze a logged session
+#
+def analyze(sessionPath):
+    session = Logbook.Reader(sessionPath)
+    try:
+        result = analyzeColumns(session.columns)
+        result['meta'] = session.meta
+    finally:
+        session.close()
+    return result
+
+
+def analyzeAll(logDir):
+    return [analyze(path) for path in Logbook.sessions(logDir)]
+
+
+if __name__ == "__main__":
+    logDir = User.logDir
+    if len(sys.argv) > 1:
+        logDir = sys.argv[1]
+
+    start = time.perf_counter()
+    results = analyzeAll(logDir)
+    secs = time.perf_counter() - start
+
+    for result in results:
+        print("{:>8s} {:7.0f} m {:7.1f} s  {:>6s} /500m  {:5.0f} W".format(
+            str(result['meta'].get('intensity')), result['totalDistance'], result['totalTime'],
+            "{:.1f}".format(result.get('avgPace', 0)), result.get('avgWatts', 0)))
+    print("Analyzed {} sessions in {:.3f} secs".format(len(results), secs))
@@ -0,0 +1,426 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# CSAFE commands and frames, as understood by the PM-5
+#
+# A command is the 'bytes' of its opcode, followed, for long commands (opcode < 0x80),
+# by the number of data bytes and the data.
+# A frame wraps one or more commands with the start flag, a checksum and the stop flag,
+# with any byte in the 0xF0-0xF3 range byte-stuffed.
+#
+
+import asyncio
+import functools
+import operator
+import re
+
+
+#
+# Frame flags
+#
+extStartFlag = 0xF0
+startFlag    = 0xF1
+stopFlag     = 0xF2
+stuffFlag    = 0xF3
+
+# Largest frame the PM-5 accepts
+maxFrameSize = 120
+
+# Default largest BLE write (ATT MTU of 23 bytes, minus the ATT header)
+maxWriteSize = 20
+
+
+#
+# Standard short commands (no data)
+#
+GETSTATUS    = 0x80
+RESET        = 0x81
+GOIDLE       = 0x82
+GOHAVEID     = 0x83
+GOINUSE      = 0x85
+GOFINISHED   = 0x86
+GOREADY      = 0x87
+BADID        = 0x88
+GETVERSION   = 0x91
+GETID        = 0x92
+GETUNITS     = 0x93
+GETSERIAL    = 0x94
+GETODOMETER  = 0x9B
+GETERRORCODE = 0x9C
+GETTWORK     = 0xA0
+GETHORIZONTAL = 0xA1
+GETCALORIES  = 0xA3
+GETPROGRAM   = 0xA4
+GETPACE      = 0xA6
+GETCADENCE   = 0xA7
+GETHRCUR     = 0xB0
+GETPOWER     = 0xB4
+
+#
+# Standard long commands
+#
+SETUSERCFG1  = 0x1A     # Concept2 wrapper for the PM-specific commands
+SETTIMEOUT   = 0x13
+SETTIME      = 0x11
+SETDATE      = 0x12
+SETTWORK     = 0x20
+SETHORIZONTAL = 0x21
+SETCALORIES  = 0x23
+SETPROGRAM   = 0x24
+SETPOWER     = 0x34
+GETCAPS      = 0x70
+
+#
+# Concept2 PM-specific commands (wrapped in SETUSERCFG1)
+#
+PM_SET_WORKOUTTYPE       = 0x01
+PM_SET_WORKOUTDURATION   = 0x03
+PM_SET_RESTDURATION      = 0x04
+PM_SET_SPLITDURATION     = 0x05
+PM_SET_SCREENSTATE       = 0x13
+PM_GET_WORKOUTTYPE       = 0x89
+PM_GET_WORKOUTSTATE      = 0x8D
+PM_GET_WORKTIME          = 0xA0
+PM_GET_WORKDISTANCE      = 0xA3
+PM_GET_DRAGFACTOR        = 0xC1
+
+# Commands that return data in their response
+dataCommands = {GETVERSION, GETID, GETUNITS, GETSERIAL, GETODOMETER, GETERRORCODE, GETTWORK, GETHORIZONTAL,
+                GETCALORIES, GETPROGRAM, GETPACE, GETCADENCE, GETHRCUR, GETPOWER, GETCAPS,
+                PM_GET_WORKOUTTYPE, PM_GET_WORKOUTSTATE, PM_GET_WORKTIME, PM_GET_WORKDISTANCE, PM_GET_DRAGFACTOR}
+
+# Units
+unitsMeters = 0x24
+
+# Duration types, for PM_SET_SPLITDURATION
+durationTime     = 0x00
+durationDistance = 0x80
+
+
+#
+# Build a command
+#
+def command(opcode, data=b''):
+    if opcode >= 0x80:
+        if len(data) != 0:
+            raise ValueError("CSAFE short command 0x{:02X} takes no data".format(opcode))
+        return bytes((opcode,))
+    return bytes((opcode, len(data))) + bytes(data)
+
+
+#
+# Build a Concept2 PM-specific command
+#
+def pmCommand(opcode, data=b''):
+    return command(SETUSERCFG1, command(opcode, data))
+
+
+#
+# Typed builders for the commands used to program a workout
+#
+def setTWork(secs):
+    secs = int(round(secs))
+    return command(SETTWORK, bytes((secs // 3600, secs // 60 % 60, secs % 60)))
+
+def setHorizontal(meters):
+    meters = int(meters)
+    return command(SETHORIZONTAL, bytes((meters & 0xFF, meters >> 8, unitsMeters)))
+
+def setProgram(program):
+    return command(SETPROGRAM, bytes((program, 0x00)))
+
+# Split duration in seconds or in meters
+def setSplitDuration(secs=None, meters=None):
+    if secs is not None:
+        return pmCommand(PM_SET_SPLITDURATION, bytes((durationTime,)) + int(round(secs * 100)).to_bytes(4, 'little'))
+    return pmCommand(PM_SET_SPLITDURATION, bytes((durationDistance,)) + int(meters).to_bytes(4, 'little'))
+
+
+_stuffable = re.compile(b'[\xF0-\xF3]')
+
+def _stuffByte(match):
+    return bytes((stuffFlag, match.group()[0] - extStartFlag))
+
+#
+# Frame the commands, adding start, checksum, and stop flags.
+# The checksum is computed over the unstuffed commands, then stuffed along with them.
+#
+def frame(commands):
+    checksum = functools.reduce(operator.xor, commands, 0)
+    return bytes((startFlag,)) + _stuffable.sub(_stuffByte, commands + bytes((checksum,))) + bytes((stopFlag,))
+
+
+#
+# Frames to program a workout phase (see Workout.Session.createPhases), in as few BLE writes as possible.
+# A free phase, with neither a duration nor a distance, just starts rowing.
+#
+def phaseFrames(phase, maxWrite=maxWriteSize):
+    commands = [command(GOREADY)]
+    if phase.get('duration') is not None:
+        tsplit = (phase['duration'] + phase['restTime']) * 60
+        commands.append(setTWork(tsplit * phase['repeat']))
+        commands.append(setSplitDuration(secs=tsplit))
+        commands.append(setProgram(0))
+    elif phase.get('distance') is not None:
+        commands.append(setHorizontal(phase['distance'] * phase['repeat']))
+        commands.append(setSplitDuration(meters=phase['distance']))
+        commands.append(setProgram(0))
+    commands.append(command(GOINUSE))
+    return pack(commands, maxWrite)
+
+
+#
+# Frames of the state commands, built only once
+#
+goIdleFrame  = frame(command(GOIDLE))
+goReadyFrame = frame(command(GOREADY))
+goInUseFrame = frame(command(GOINUSE))
+
+
+#
+# Pack a list of commands into as few frames as possible, each fitting in a single BLE write
+#
+def pack(commands, maxWrite=maxWriteSize):
+    maxWrite = min(maxWrite, maxFrameSize)
+    frames  = []
+    pending = b''
+    for cmd in commands:
+        if len(frame(cmd)) > maxWrite:
+            raise ValueError("CSAFE command 0x{:02X} does not fit in a {}-byte write".format(cmd[0], maxWrite))
+        if pending and len(frame(pending + cmd)) > maxWrite:
+            frames.append(frame(pending))
+            pending = b''
+        pending += cmd
+    if pending:
+        frames.append(frame(pending))
+    return frames
+
+
+#
+# A response frame: the PM-5 status byte and the data returned for each command, by opcode.
+# The responses to the PM-specific commands are unwrapped from their SETUSERCFG1 response.
+#
+class Response:
+
+    def __init__(self, status, data):
+        self.status = status
+        self.data   = data
+
+    # Frame toggle in bit 7, previous frame status in bits 5-4, state machine state in bits 3-0
+    def state(self):
+        return self.status & 0x0F
+
+    def __getitem__(self, opcode):
+        return self.data[opcode]
+
+    def __contains__(self, opcode):
+        return opcode in self.data
+
+    def __repr__(self):
+        return "CSAFE.Response(0x{:02X}, {{{}}})".format(self.status, ", ".join(["0x{:02X}: {}".format(opcode, data.hex())
+                                                                                for opcode, data in self.data.items()]))
+
+
+def parseCommands(contents, start, end, data):
+    i = start
+    while i + 1 < end:
+        opcode = contents[i]
+        n      = contents[i+1]
+        value  = contents[i+2:i+2+n]
+        if opcode == SETUSERCFG1:
+            parseCommands(contents, i+2, i+2+n, data)
+        else:
+            data[opcode] = bytes(value)
+        i += 2 + n
+
+
+#
+# Parse the unstuffed contents of a response frame, without the checksum
+#
+def parseResponse(contents):
+    data = {}
+    parseCommands(contents, 1, len(contents), data)
+    return Response(contents[0], data)
+
+
+_stuffed = re.compile(b'\xF3([\x00-\x03])')
+
+def _unstuffByte(match):
+    return bytes((extStartFlag + match.group(1)[0],))
+
+
+#
+# Opcodes of the commands in a frame, with the PM-specific commands unwrapped
+#
+def frameOpcodes(frame):
+    commands = _stuffed.sub(_unstuffByte, frame[1:-1])[:-1]
+    opcodes = set()
+    def scan(start, end):
+        i = start
+        while i < end:
+            opcode = commands[i]
+            if opcode >= 0x80:
+                opcodes.add(opcode)
+                i += 1
+                continue
+            n = commands[i+1]
+            if opcode == SETUSERCFG1:
+                scan(i+2, min(i+2+n, end))
+            else:
+                opcodes.add(opcode)
+            i += 2 + n
+    scan(0, len(commands))
+    return opcodes
+
+
+#
+# Incremental frame parser
+#
+# The PM-5 sends the response frames in as many 'getCSAFE' notifications as needed.
+# Fragments are accumulated in a buffer, and complete frames are extracted from it
+# without rescanning what has already been searched for the stop flag.
+# Frames with a bad checksum, and bytes outside of a frame, are dropped.
+#
+class Parser:
+
+    def __init__(self):
+        self.buffer  = bytearray()
+        self.scanned = 0
+        self.errors  = 0
+
+
+    #
+    # Add a notification. Returns the unstuffed contents of the frames it completed.
+    #
+    def feed(self, data):
+        buffer = self.buffer
+        buffer += data
+
+        frames = []
+        while True:
+            start = buffer.find(startFlag)
+            if start < 0:
+                del buffer[:]
+                self.scanned = 0
+                break
+            if start > 0:
+                del buffer[:start]
+                self.scanned = max(0, self.scanned - start)
+
+            stop = buffer.find(stopFlag, max(1, self.scanned))
+            if stop < 0:
+                self.scanned = len(buffer)
+                break
+
+            with memoryview(buffer) as view:
+                contents = _stuffed.sub(_unstuffByte, view[1:stop])
+            del buffer[:stop+1]
+            self.scanned = 0
+
+            if len(contents) < 2 or functools.reduce(operator.xor, contents, 0) != 0:
+                self.errors += 1
+                continue
+            frames.append(contents[:-1])
+
+        return frames
+
+
+#
+# Match the responses to their command frame
+#
+# The PM-5 processes one frame at a time and responds to each in order,
+# so frames are sent one at a time. A response resolves the outstanding request
+# only if it holds the data for all of the request's 'get' commands, and nothing else:
+# a late response to a request that timed out is dropped instead of resolving the next one.
+# 'write' is a coroutine function that writes a frame to the PM-5.
+#
+class Requester:
+
+    def __init__(self, write, timeout=1.0):
+        self.write   = write
+        self.timeout = timeout
+        self.parser  = Parser()
+        self.pending = []
+        self.dropped = 0
+        self.lock    = asyncio.Lock()
+
+
+    #
+    # 'getCSAFE' notification handler
+    #
+    def notify(self, charHandle, val):
+        for contents in self.parser.feed(val):
+            response = parseResponse(contents)
+            while len(self.pending) > 0:
+                future, opcodes = self.pending[0]
+                if future.done():
+                    self.pending.pop(0)
+                    continue
+                if (opcodes & dataCommands) <= response.data.keys() <= opcodes:
+                    self.pending.pop(0)
+                    future.set_result(response)
+                else:
+                    self.dropped += 1
+                break
+
+
+    #
+    # Send a frame and return its Response
+    # Raises asyncio.TimeoutError if the PM-5 does not respond
+    #
+    async def send(self, frame):
+        async with self.lock:
+            future  = asyncio.get_running_loop().create_future()
+            request = (future, frameOpcodes(frame))
+            self.pending.append(request)
+            try:
+                await self.write(frame)
+                return await asyncio.wait_for(future, self.timeout)
+            finally:
+                if request in self.pending:
+                    self.pending.remove(request)
+
+
+    async def request(self, *commands):
+        return await self.send(frame(b''.join(commands)))
+
+
+    #
+    # Read the PM-5 state
+    #
+    async def getSerial(self):
+        rsp = await self.request(command(GETSERIAL))
+        return rsp[GETSERIAL].decode('ascii', 'replace')
+
+    async def getDragFactor(self):
+        rsp = await self.request(pmCommand(PM_GET_DRAGFACTOR))
+        return rsp[PM_GET_DRAGFACTOR][0]
+
+    async def getWorkoutType(self):
+        rsp = await self.request(pmCommand(PM_GET_WORKOUTTYPE))
+        return rsp[PM_GET_WORKOUTTYPE][0]
+
+    # Programmed work time, in seconds
+    async def getTWork(self):
+        rsp = await self.request(command(GETTWORK))
+        h, m, s = rsp[GETTWORK][:3]
+        return h * 3600 + m * 60 + s
+
+    # Programmed distance, in meters
+    async def getHorizontal(self):
+        rsp = await self.request(command(GETHORIZONTAL))
+        return int.from_bytes(rsp[GETHORIZONTAL][:2], 'little')
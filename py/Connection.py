@@ -0,0 +1,170 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# Persistent BLE connection to the PM-5
+#
+# The address and serial number of the last PM-5 we connected to are cached on disk
+# so we can connect to it directly, without a (slow) discovery scan.
+# A full scan is only done when the cached PM-5 cannot be reached,
+# A connection request makes a bounded number of attempts, with an exponential backoff
+# between them to give the PM-5 time to wake up.
+#
+
+import asyncio
+import json
+import os
+
+import Logger
+from PM5 import PM5UUID
+
+
+log = Logger.get("PM5")
+
+
+defaultCachePath = os.path.expanduser("~/.pROWess/pm5.json")
+
+
+class Connection:
+
+    def __init__(self, keepWarm=False, cachePath=defaultCachePath):
+        # Stay connected between workouts?
+        self.keepWarm  = keepWarm
+        self.cachePath = cachePath
+        self.client    = None
+        self.address   = None
+        self.serial    = None
+
+        # Called when the PM-5 drops the connection (but not when it is released)
+        self.onDisconnect = None
+
+        self.attempts   = 4
+        self.minBackoff = 1
+        self.maxBackoff = 32
+
+        self.connectTimeout = 10
+        self.scanTimeout    = 5
+
+        try:
+            with open(self.cachePath) as f:
+                cached = json.load(f)
+            self.address = cached['address']
+            self.serial  = cached['serial']
+        except (OSError, ValueError, KeyError):
+            pass
+
+
+    def isConnected(self):
+        return self.client is not None and self.client.is_connected
+
+
+    def saveCache(self):
+        os.makedirs(os.path.dirname(self.cachePath), exist_ok=True)
+        with open(self.cachePath, 'w') as f:
+            json.dump({'address': self.address, 'serial': self.serial}, f)
+
+
+    def disconnected(self, client):
+        if client is self.client:
+            self.client = None
+            log.warning("PM5 disconnected")
+            if self.onDisconnect is not None:
+                self.onDisconnect()
+
+
+    #
+    # Connect to a PM-5 at the specified address (or BLEDevice)
+    # and return the connected client, or None if it could not be reached.
+    #
+    async def connectTo(self, address):
+        # bleak is slow to import: only import it when first needed
+        from bleak import BleakClient
+
+        client = BleakClient(address, timeout=self.connectTimeout, disconnected_callback=self.disconnected)
+        try:
+            await client.connect()
+            val = await client.read_gatt_char(PM5UUID['getSerial'])
+        except Exception as err:
+            log.warning("Cannot connect to PM5 at %s: %s", address, err)
+            try:
+                await client.disconnect()
+            except Exception:
+                pass
+            return None
+
+        self.client = client
+        if val.decode() != self.serial:
+            self.serial = val.decode()
+            self.saveCache()
+        log.info("Connected to PM5 Serial no %s", self.serial)
+        return client
+
+
+    async def discover(self):
+        from bleak import discover
+
+        devices = await discover(timeout=self.scanTimeout)
+        for device in devices:
+            if device.name is not None and 'PM5' in device.name:
+                return device
+        return None
+
+
+    #
+    # Re-uses the warm connection, then tries the cached address, then falls back to a full scan.
+    #
+    async def tryConnect(self):
+        if self.isConnected():
+            return self.client
+
+        if self.address is not None:
+            client = await self.connectTo(self.address)
+            if client is not None:
+                return client
+
+        device = await self.discover()
+        if device is not None:
+            self.address = device.address
+            self.serial  = None
+            return await self.connectTo(device)
+        return None
+
+
+    #
+    # Return a connected client, or None if no PM-5 could be found after all attempts
+    #
+    async def connect(self):
+        backoff = self.minBackoff
+        for attempt in range(self.attempts):
+            if attempt > 0:
+                log.info("Retrying PM5 connection in %d s", backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(2 * backoff, self.maxBackoff)
+            client = await self.tryConnect()
+            if client is not None:
+                return client
+        return None
+
+
+    #
+    # Done with the current workout
+    #
+    async def release(self):
+        if self.keepWarm or self.client is None:
+            return
+        client = self.client
+        self.client = None
+        await client.disconnect()
@@ -14,17 +14,82 @@
 # limitations under the License.
 #
 
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_tkagg import (FigureCanvasTkAgg,
-                                               NavigationToolbar2Tk)
 import tkinter as tk
 import tkinter.ttk
 import time
 
+import Latency
 import User
 
-def now():
-    return int(time.time())
+#
+# numpy and matplotlib take a long time to import on a Pi Zero,
+# so they are only imported when a workout is requested, in a worker thread (see MainDisplay.buildPlots()),
+# or, failing that, when the first sample is plotted
+#
+np                = None
+Figure            = None
+FigureCanvasTkAgg = None
+
+def importPlotting():
+    global np, Figure, FigureCanvasTkAgg
+
+    if np is not None:
+        return
+
+    import numpy
+    import matplotlib.figure
+    import matplotlib.backends.backend_tkagg
+
+    np                = numpy
+    Figure            = matplotlib.figure.Figure
+    FigureCanvasTkAgg = matplotlib.backends.backend_tkagg.FigureCanvasTkAgg
+
+
+#
+# Coalesce the updates to the widgets.
+# Widget options are only applied when they differ from what is currently rendered,
+# in a single batch flushed from the Tk idle loop at most 'fps' times per second.
+# Widgets are identified by their configure method (or any method taking keyword arguments).
+#
+class RenderModel:
+    def __init__(self, root, fps):
+        self.root        = root
+        self.minInterval = 1.0 / fps
+        self.rendered    = {}
+        self.pending     = {}
+        self.scheduled   = None
+        self.lastFlush   = 0
+
+    def set(self, configure, **options):
+        pending = self.pending.get(configure)
+        if pending is None:
+            self.pending[configure] = options
+        else:
+            pending.update(options)
+
+        if self.scheduled is None:
+            delay = self.lastFlush + self.minInterval - time.monotonic()
+            if delay <= 0:
+                self.scheduled = self.root.after_idle(self.flush)
+            else:
+                self.scheduled = self.root.after(int(delay * 1000) + 1, self.flush)
+
+    def flush(self):
+        t0 = Latency.start()
+        self.scheduled = None
+        self.lastFlush = time.monotonic()
+
+        pending = self.pending
+        self.pending = {}
+        for configure, options in pending.items():
+            rendered = self.rendered.get(configure)
+            if rendered is None:
+                rendered = self.rendered[configure] = {}
+            changed = {key: val for key, val in options.items() if rendered.get(key) != val}
+            if changed:
+                configure(**changed)
+                rendered.update(changed)
+        Latency.rendered(t0)
 
 #
 # Frame with a set of widgets that displays the main workout numbers
@@ -61,21 +126,161 @@ class NumbersFrame(tk.Frame):
         self.Status.grid(row=3, column=0, columnspan=4, sticky=tk.N+tk.S+tk.E+tk.W)
 
 
+#
+# Fixed-size ring buffer of (time, value) samples
+# The samples are copied in chronological order into preallocated arrays when plotted.
+#
+class RingBuffer:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.t        = np.zeros(capacity)
+        self.y        = np.zeros(capacity)
+        self.orderedT = np.zeros(capacity)
+        self.orderedY = np.zeros(capacity)
+        self.clear()
+
+    def clear(self):
+        self.next  = 0
+        self.count = 0
+
+    def append(self, t, y):
+        self.t[self.next] = t
+        self.y[self.next] = y
+        self.next += 1
+        if self.next == self.capacity:
+            self.next = 0
+        if self.count < self.capacity:
+            self.count += 1
+
+    # Return the samples in chronological order, relative to time 'now'
+    def ordered(self, now):
+        n = self.count
+        older = n - self.next
+        outT = self.orderedT[:n]
+        outY = self.orderedY[:n]
+        if older > 0:
+            outT[:older] = self.t[self.capacity - older:]
+            outY[:older] = self.y[self.capacity - older:]
+        outT[older:] = self.t[:self.next]
+        outY[older:] = self.y[:self.next]
+        outT -= now
+        return outT, outY
+
+
+#
+# Streaming time-series plot of the last 'span' seconds
+# 'series' is a list of (name, color, (ymin, ymax)) tuples. A second series is plotted against a twin y axis.
+#
+# Only the lines are redrawn, using blitting over a cached background, at most 'fps' times per second.
+# The axes are only redrawn when a value falls outside of the current y range.
+#
 class Plotter(tk.Frame):
-    def __init__(self, parent, **kwargs):
+    def __init__(self, parent, series, span=300, capacity=3000, fps=2, **kwargs):
         super().__init__(parent, kwargs)
 
-        xInch = kwargs['width']/User.screen['DPI']
-        yInch = kwargs['height']/User.screen['DPI']
-        self.figure = Figure(figsize=(xInch, yInch), dpi=User.screen['DPI'])
-        fig = Figure(figsize=(5, 4), dpi=100)
-        t = [1, 2, 3, 4, 5, 6]
-        fig.add_subplot(111).plot(t, t)
-        
-        canvas = FigureCanvasTkAgg(fig, master=self)  # A tk.DrawingArea.
-        canvas.draw()
-        canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=1)
-        
+        self.xInch = kwargs['width']/User.screen['DPI']
+        self.yInch = kwargs['height']/User.screen['DPI']
+
+        self.series      = series
+        self.span        = span
+        self.capacity    = capacity
+        self.minInterval = 1.0 / fps
+        self.lastDraw    = 0
+        self.scheduled   = None
+        self.background  = None
+        self.canvas      = None
+        self.now         = 0
+
+
+    #
+    # The figure is only created when a workout is requested, or when the first sample is plotted
+    #
+    def build(self):
+        if self.canvas is not None:
+            return
+        importPlotting()
+
+        self.figure = Figure(figsize=(self.xInch, self.yInch), dpi=User.screen['DPI'])
+        self.buffers = {}
+        self.lines   = {}
+        self.axes    = {}
+        ax = self.figure.add_subplot(111)
+        for name, color, ylim in self.series:
+            if len(self.axes) > 0:
+                ax = ax.twinx()
+            ax.set_xlim(-self.span, 0)
+            ax.set_ylim(*ylim)
+            ax.set_ylabel(name, color=color)
+            self.axes[name]    = ax
+            self.lines[name]   = ax.plot([], [], color=color, animated=True)[0]
+            self.buffers[name] = RingBuffer(self.capacity)
+        self.figure.tight_layout()
+
+        self.canvas = FigureCanvasTkAgg(self.figure, master=self)
+        self.canvas.mpl_connect('draw_event', self.cacheBackground)
+        self.canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=1)
+        self.canvas.draw()
+
+
+    def cacheBackground(self, event):
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self.blit()
+
+
+    def clear(self):
+        if self.canvas is None:
+            return
+        for buffer in self.buffers.values():
+            buffer.clear()
+        self.schedule()
+
+
+    #
+    # Add a sample. Use NaN for a missing value, to break the line.
+    #
+    def append(self, name, t, value):
+        if self.canvas is None:
+            self.build()
+
+        self.buffers[name].append(t, value)
+        self.now = t
+
+        # Rescale if needed. That requires a full redraw.
+        ax = self.axes[name]
+        ymin, ymax = ax.get_ylim()
+        lo, hi = min(ymin, ymax), max(ymin, ymax)
+        if value < lo or value > hi:
+            if ymin <= ymax:
+                ax.set_ylim(min(lo, value), max(hi, value))
+            else:
+                ax.set_ylim(max(hi, value), min(lo, value))
+            self.canvas.draw_idle()
+            return
+
+        self.schedule()
+
+
+    def schedule(self):
+        if self.scheduled is not None:
+            return
+        delay = self.lastDraw + self.minInterval - time.monotonic()
+        self.scheduled = self.after(max(int(delay * 1000), 0) + 1, self.blit)
+
+
+    def blit(self):
+        if self.scheduled is not None:
+            self.after_cancel(self.scheduled)
+            self.scheduled = None
+        if self.background is None:
+            return
+        self.lastDraw = time.monotonic()
+
+        self.canvas.restore_region(self.background)
+        for name, line in self.lines.items():
+            line.set_data(*self.buffers[name].ordered(self.now))
+            self.axes[name].draw_artist(line)
+        self.canvas.blit(self.figure.bbox)
+
 
 class Progress(tk.Frame):
     def __init__(self, parent, **kwargs):
@@ -132,8 +337,8 @@ class MainDisplay(tk.Tk):
         self.progress.grid(row=0, column=0, sticky=tk.N+tk.S+tk.E+tk.W)
 
         # Bottom half layout
-        bottomLeftFrame   = Plotter(bottomHalfFrame, width=int(bottomHalfFrame.winfo_width()/3), height=bottomHalfFrame.winfo_height(), borderwidth=1, relief=tk.GROOVE)
-        bottomMiddleFrame = Plotter(bottomHalfFrame, width=int(bottomHalfFrame.winfo_width()/3), height=bottomHalfFrame.winfo_height(), borderwidth=1, relief=tk.GROOVE)
+        bottomLeftFrame   = Plotter(bottomHalfFrame, [("Split", 'blue', (210, 90))], width=int(bottomHalfFrame.winfo_width()/3), height=bottomHalfFrame.winfo_height(), borderwidth=1, relief=tk.GROOVE)
+        bottomMiddleFrame = Plotter(bottomHalfFrame, [("Strokes/min", 'black', (10, 40)), ("Heart rate", 'red', (50, 200))], width=int(bottomHalfFrame.winfo_width()/3), height=bottomHalfFrame.winfo_height(), borderwidth=1, relief=tk.GROOVE)
         bottomRightFrame  = NumbersFrame(bottomHalfFrame, width=int(bottomHalfFrame.winfo_width()/3), height=bottomHalfFrame.winfo_height(), borderwidth=1, relief=tk.GROOVE)
         bottomHalfFrame.rowconfigure(0, weight=1)
         bottomHalfFrame.columnconfigure(0, weight=1)
@@ -145,8 +350,12 @@ class MainDisplay(tk.Tk):
 
         # Keep reference to the frames we need to update
         self.numbers = bottomRightFrame
-        self.startTime = None
-        self.lastTime  = None
+        self.paceGraph   = bottomLeftFrame
+        self.strokeGraph = bottomMiddleFrame
+        # Latest PM-5 counters, and the time and distance covered in the current phase
+        self.lastElapsedTime = None
+        self.lastDistance    = None
+        self.duration  = 0
         self.distance  = 0
         self.heartBeatState = False
 
@@ -159,6 +368,18 @@ class MainDisplay(tk.Tk):
 
         self.freeze = False
 
+        self.render = RenderModel(self, User.displayFPS)
+
+        # Debug overlay, toggled with F2
+        self.overlay = tk.Label(master=self, text="", font=('Courier', 12), justify=tk.LEFT, anchor=tk.NW, bg='lightyellow')
+        self.overlayShown = False
+        self.bind('<F2>', self.toggleOverlay)
+
+        # Summary of the last workout, shown over the graphs until the next one starts
+        # so the status messages do not overwrite it
+        self.summary = tk.Label(master=self, text="", font=('Arial', 20), justify=tk.LEFT, bg='white',
+                                relief=tk.RIDGE, borderwidth=2)
+
 
     #
     # Configure overall workout for progress bar
@@ -167,52 +388,62 @@ class MainDisplay(tk.Tk):
         self.durationAccum = 0;
         self.durationEndGoal = duration
         if self.durationEndGoal == None:
-            self.numbers.TimeLabel.configure(text="Time:")
+            self.render.set(self.numbers.TimeLabel.configure, text="Time:")
         else:
             self.durationEndGoal *= User.secsInOneMin
-            self.numbers.TimeLabel.configure(text="Left:")
-            self.numbers.WorkoutTime.configure(text=MMSS(self.durationEndGoal))
+            self.render.set(self.numbers.TimeLabel.configure, text="Left:")
+            self.render.set(self.numbers.WorkoutTime.configure, text=MMSS(self.durationEndGoal))
 
         self.distanceAccum = 0;
+        self.distanceEndGoal = distance
         if self.distanceEndGoal == None:
-            self.numbers.DistanceLabel.configure(text="Dist:")
+            self.render.set(self.numbers.DistanceLabel.configure, text="Dist:")
         else:
             self.distanceEndGoal = distance * User.metersInOneKm / 1000
-            self.numbers.DistanceLabel.configure(text="Left:")
-            self.numbers.Distance.configure(text="{:4d} m".format(int(self.distanceEndGoal)))
+            self.render.set(self.numbers.DistanceLabel.configure, text="Left:")
+            self.render.set(self.numbers.Distance.configure, text="{:4d} m".format(int(self.distanceEndGoal)))
             
         
     #
     # Configure the next phase
     #
     def configurePhase(self, duration, distance):
+        self.duration = 0
+        self.distance = 0
         self.durationGoal = duration
         if self.durationGoal == None:
-            self.numbers.TimeLabel.configure(text="Time:")
+            self.render.set(self.numbers.TimeLabel.configure, text="Time:")
         else:
             self.durationGoal *= User.secsInOneMin
-            self.numbers.TimeLabel.configure(text="Left:")
-            self.numbers.WorkoutTime.configure(text=MMSS(self.durationGoal))
+            self.render.set(self.numbers.TimeLabel.configure, text="Left:")
+            self.render.set(self.numbers.WorkoutTime.configure, text=MMSS(self.durationGoal))
 
+        self.distanceGoal = distance
         if self.distanceGoal == None:
-            self.numbers.DistanceLabel.configure(text="Dist:")
+            self.render.set(self.numbers.DistanceLabel.configure, text="Dist:")
         else:
             self.distanceGoal = distance * User.metersInOneKm / 1000
-            self.numbers.DistanceLabel.configure(text="Left:")
-            self.numbers.Distance.configure(text="{:4d} m".format(int(self.distanceGoal)))
+            self.render.set(self.numbers.DistanceLabel.configure, text="Left:")
+            self.render.set(self.numbers.Distance.configure, text="{:4d} m".format(int(self.distanceGoal)))
         
     
     #
     # Start/stop workout display
     #
-    def start(self, nowT = None):
-        if nowT is None:
-            nowT = now()
-            
-        self.startTime = nowT
-        self.lastTime  = nowT
-        self.distance  = 0
+    #
+    # Build the plots before the PM-5 notifications start.
+    # The plotting modules must already be imported (see importPlotting()): they are too slow to import here.
+    #
+    def buildPlots(self):
+        self.paceGraph.build()
+        self.strokeGraph.build()
+
+
+    def start(self):
         self.updateStatus("")
+        self.summary.place_forget()
+        self.paceGraph.clear()
+        self.strokeGraph.clear()
 
         self.freeze = False
 
@@ -222,19 +453,15 @@ class MainDisplay(tk.Tk):
         color = 'red'
         if self.heartBeatState:
             color = 'black'
-        self.numbers.Heart.configure(fg=color)
+        self.render.set(self.numbers.Heart.configure, fg=color)
 
 
     def pause(self):
-        self.lastTime  = now()
         self.updateStatus("PAUSED", 'red')
         self.freeze = True
 
 
     def resume(self):
-        nowT = now()
-        self.startTime += nowT - self.lastTime
-        self.lastTime  = nowT
         self.updateStatus("")
 
         self.freeze = False
@@ -242,61 +469,67 @@ class MainDisplay(tk.Tk):
 
     def stop(self):
         self.pause()
+        self.lastElapsedTime = None
+        self.lastDistance    = None
+        self.duration = 0
         self.distance = 0
         self.distanceGoal = None
         self.durationGoal = None
         self.updateStatus("Done!")
 
     #
-    # Update the data the display is tracking
+    # Update the data the display is tracking from the PM-5 counters:
+    # elapsed time (in seconds) and distance (in meters) since the start of the PM-5 workout.
+    # The counters are authoritative: only their increments are accumulated
+    # so the display never drifts from the monitor.
     # Return True is the current split is finished
     #
-    def updateSpeed(self, speedInMeterPerSec):
-        if self.freeze:
-            return False
-        
-        nowT = now()
+    def updateProgress(self, elapsedTime, distance, speedInMeterPerSec):
+        # The PM-5 restarts its counters with each programmed phase
+        dt = elapsedTime
+        if self.lastElapsedTime is not None and elapsedTime >= self.lastElapsedTime:
+            dt -= self.lastElapsedTime
+        dd = distance
+        if self.lastDistance is not None and distance >= self.lastDistance:
+            dd -= self.lastDistance
+        self.lastElapsedTime = elapsedTime
+        self.lastDistance    = distance
 
-        if speedInMeterPerSec == 0:
+        if self.freeze:
             return False
 
-        if self.startTime is None:
-            self.start(nowT)
-
         phaseDone = False;
-        
-        duration = nowT - self.startTime
-        self.durationAccum += nowT - self.lastTime
+
+        self.duration += dt
+        self.durationAccum += dt
         if self.durationGoal == None:
-            self.numbers.WorkoutTime.configure(text=MMSS(duration))
+            self.render.set(self.numbers.WorkoutTime.configure, text=MMSS(self.duration))
         else:
-            left = self.durationGoal - duration
+            left = self.durationGoal - self.duration
             if left < 0:
                 left = 0
-            self.numbers.WorkoutTime.configure(text=MMSS(left))
+            self.render.set(self.numbers.WorkoutTime.configure, text=MMSS(left))
             if left == 0:
                 phaseDone = True
             if self.durationEndGoal != None and self.durationAccum <= self.durationEndGoal:
-                self.progress.updatePercent(int(self.durationAccum * 100 / self.durationEndGoal))
+                self.render.set(self.progress.updatePercent, percent=int(self.durationAccum * 100 / self.durationEndGoal))
 
-        self.numbers.SplitTime.configure(text=MMSS(500 / speedInMeterPerSec))
+        if speedInMeterPerSec > 0:
+            self.render.set(self.numbers.SplitTime.configure, text=MMSS(500 / speedInMeterPerSec))
 
-        dist = speedInMeterPerSec * (nowT - self.lastTime)
-        self.distance += dist
-        self.distanceAccum += dist
+        self.distance += dd
+        self.distanceAccum += dd
         if self.distanceGoal == None:
-            self.numbers.Distance.configure(text="{:4d} m".format(int(self.distance)))
+            self.render.set(self.numbers.Distance.configure, text="{:4d} m".format(int(self.distance)))
         else:
             left = self.distanceGoal - self.distance
             if left < 0:
                 left = 0
-            self.numbers.Distance.configure(text="{:4d} m".format(int(left)))
+            self.render.set(self.numbers.Distance.configure, text="{:4d} m".format(int(left)))
             if left == 0:
                 phaseDone = True
             if self.distanceEndGoal != None and self.distanceAccum <= self.distanceEndGoal:
-                self.progress.updatePercent(int(self.distanceAccum * 100 / self.distanceEndGoal))
-
-        self.lastTime = nowT
+                self.render.set(self.progress.updatePercent, percent=int(self.distanceAccum * 100 / self.distanceEndGoal))
 
         return phaseDone
         
@@ -305,17 +538,65 @@ class MainDisplay(tk.Tk):
         if self.freeze:
             return
         
-        self.numbers.StrokeRate.configure(text=str(strokesPerMin))
+        self.render.set(self.numbers.StrokeRate.configure, text=str(strokesPerMin))
 
         
     def updateHeartBeat(self, beatsPerMin):
         if beatsPerMin == 255:
             return
-        self.numbers.HeartRate.configure(text=str(beatsPerMin))
+        self.render.set(self.numbers.HeartRate.configure, text=str(beatsPerMin))
+
+
+    #
+    # Add a sample to the live plots
+    #
+    def updatePlots(self, speedInMeterPerSec, strokesPerMin, beatsPerMin):
+        if self.freeze:
+            return
+
+        t = time.monotonic()
+        split = float('nan')
+        if speedInMeterPerSec > 0:
+            split = 500 / speedInMeterPerSec
+        self.paceGraph.append("Split", t, split)
+        self.strokeGraph.append("Strokes/min", t, strokesPerMin)
+        if beatsPerMin == 255:
+            beatsPerMin = float('nan')
+        self.strokeGraph.append("Heart rate", t, beatsPerMin)
+
+
+    #
+    # Display the post-workout analytics (see Analytics.analyze())
+    #
+    def showSummary(self, summary):
+        if summary['totalDistance'] == 0:
+            return
+        text = "{:d} m in {}".format(int(summary['totalDistance']), MMSS(summary['totalTime']))
+        if 'avgPace' in summary:
+            text += ", {} /500m, {:d} W avg".format(MMSS(summary['avgPace']), int(summary['avgWatts']))
+        if 'paceDrift' in summary:
+            text += ", drift {:+.1f} s/min".format(summary['paceDrift'])
+        if summary.get('splits'):
+            text += "\nSplits: " + " ".join([MMSS(t) for t in summary['splits'][:8]])
+        self.summary.configure(text=text)
+        self.summary.place(relx=0.5, rely=0.5, anchor=tk.CENTER)
+
+
+    def toggleOverlay(self, event=None):
+        self.overlayShown = not self.overlayShown
+        if self.overlayShown:
+            self.overlay.place(relx=1.0, y=0, anchor=tk.NE)
+        else:
+            self.overlay.place_forget()
+
+
+    def showOverlay(self, text):
+        if self.overlayShown:
+            self.render.set(self.overlay.configure, text=text)
 
 
     def updateStatus(self, text, color='black'):
-        self.numbers.Status.configure(text=text, fg=color)
+        self.render.set(self.numbers.Status.configure, text=text, fg=color)
 
 
 #
@@ -0,0 +1,225 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# Indexed history of the logged workouts
+#
+# Per-session and per-500m-split aggregates, plus the best time over standard distances,
+# are computed once when a session is closed and stored in an SQLite database,
+# so summary queries never have to rescan the raw session logs.
+# Sessions are keyed on the intensity/duration/distance the workout was created with.
+#
+
+import sqlite3
+import time
+
+import Logbook
+
+
+splitDistance = 500
+
+# Distances (in meters) for which the best time in each session is indexed
+bestDistances = (500, 1000, 2000, 5000, 6000, 10000)
+
+
+schema = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id            INTEGER PRIMARY KEY,
+    path          TEXT UNIQUE,
+    start         REAL,       -- UNIX time
+    week          TEXT,       -- YYYY-WW
+    intensity     TEXT,
+    duration      INTEGER,    -- requested, in minutes
+    distance      INTEGER,    -- requested, in meters
+    totalTime     REAL,       -- secs
+    totalDistance REAL,       -- meters
+    avgPace       REAL,       -- secs / 500m
+    avgStrokeRate REAL,
+    avgHeartRate  REAL,
+    maxHeartRate  INTEGER
+);
+CREATE INDEX IF NOT EXISTS sessionsByWorkout ON sessions(intensity, duration, distance);
+CREATE INDEX IF NOT EXISTS sessionsByWeek    ON sessions(week);
+
+CREATE TABLE IF NOT EXISTS splits (
+    session  INTEGER,
+    split    INTEGER,
+    time     REAL,            -- secs
+    PRIMARY KEY (session, split)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS splitsByTime ON splits(time);
+
+CREATE TABLE IF NOT EXISTS bests (
+    distance INTEGER,
+    time     REAL,            -- secs
+    session  INTEGER,
+    PRIMARY KEY (distance, time, session)
+) WITHOUT ROWID;
+"""
+
+
+#
+# The PM-5 counters restart with each phase of a workout: make them monotonic
+#
+def accumulate(values):
+    result = []
+    offset = 0
+    last   = 0
+    for val in values:
+        if val < last:
+            offset += last
+        last = val
+        result.append(offset + val)
+    return result
+
+
+#
+# Compute the aggregates of a logged session
+# Returns (summary dict, list of split times, dict of best times by distance)
+#
+def summarize(session):
+    n = len(session)
+    times     = [t / 100 for t in accumulate(session['ElapsedTime'])]
+    distances = [d / 10 for d in accumulate(session['Distance'])]
+
+    summary = {'totalTime': 0, 'totalDistance': 0, 'avgPace': None,
+               'avgStrokeRate': None, 'avgHeartRate': None, 'maxHeartRate': None}
+    if n == 0:
+        return summary, [], {}
+
+    summary['totalTime']     = times[-1]
+    summary['totalDistance'] = distances[-1]
+    if distances[-1] > 0:
+        summary['avgPace'] = times[-1] * splitDistance / distances[-1]
+
+    rates = [r for r in session['StrokeRate'] if r > 0]
+    if rates:
+        summary['avgStrokeRate'] = sum(rates) / len(rates)
+    beats = [b for b in session['HeartBPM'] if 0 < b < 255]
+    if beats:
+        summary['avgHeartRate'] = sum(beats) / len(beats)
+        summary['maxHeartRate'] = max(beats)
+
+    # Time at which each 500m mark was crossed
+    splits = []
+    lastMark = 0
+    mark = splitDistance
+    for t, d in zip(times, distances):
+        while d >= mark:
+            splits.append(t - lastMark)
+            lastMark = t
+            mark += splitDistance
+
+    # Best time over each standard distance (sliding window)
+    bests = {}
+    for target in bestDistances:
+        if target > distances[-1]:
+            break
+        best = None
+        i = 0
+        for j in range(n):
+            # Shortest window ending at sample j covering the target distance
+            while i < j and distances[j] - distances[i + 1] >= target:
+                i += 1
+            if distances[j] - distances[i] >= target:
+                if best is None or times[j] - times[i] < best:
+                    best = times[j] - times[i]
+        if best is not None:
+            bests[target] = best
+
+    return summary, splits, bests
+
+
+class History:
+
+    def __init__(self, dbPath):
+        self.db = sqlite3.connect(dbPath)
+        self.db.executescript(schema)
+
+
+    def close(self):
+        self.db.close()
+
+
+    def isIndexed(self, path):
+        return self.db.execute("SELECT 1 FROM sessions WHERE path = ?", (path,)).fetchone() is not None
+
+
+    #
+    # Index a logged session. Does nothing if it is already indexed.
+    #
+    def add(self, sessionPath):
+        if self.isIndexed(sessionPath):
+            return
+        session = Logbook.Reader(sessionPath)
+        try:
+            summary, splits, bests = summarize(session)
+            self.insert(sessionPath, session.meta, summary, splits, bests)
+        finally:
+            session.close()
+
+
+    #
+    # Index all the sessions in the log directory that are not already indexed
+    #
+    def update(self, logDir):
+        for path in Logbook.sessions(logDir):
+            self.add(path)
+
+
+    def insert(self, path, meta, summary, splits, bests):
+        start = meta.get('start', time.time())
+        with self.db:
+            cur = self.db.execute("INSERT INTO sessions (path, start, week, intensity, duration, distance, "
+                                  "totalTime, totalDistance, avgPace, avgStrokeRate, avgHeartRate, maxHeartRate) "
+                                  "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                  (path, start, time.strftime("%Y-%W", time.localtime(start)),
+                                   meta.get('intensity'), meta.get('duration'), meta.get('distance'),
+                                   summary['totalTime'], summary['totalDistance'], summary['avgPace'],
+                                   summary['avgStrokeRate'], summary['avgHeartRate'], summary['maxHeartRate']))
+            sessionId = cur.lastrowid
+            self.db.executemany("INSERT INTO splits (session, split, time) VALUES (?, ?, ?)",
+                                [(sessionId, i, t) for i, t in enumerate(splits)])
+            self.db.executemany("INSERT INTO bests (distance, time, session) VALUES (?, ?, ?)",
+                                [(d, t, sessionId) for d, t in bests.items()])
+        return sessionId
+
+
+    #
+    # Summary queries
+    #
+
+    # Best time over a standard distance: (secs, session start) or None
+    def best(self, distance):
+        return self.db.execute("SELECT b.time, s.start FROM bests b JOIN sessions s ON s.id = b.session "
+                               "WHERE b.distance = ? ORDER BY b.time LIMIT 1", (distance,)).fetchone()
+
+    # Meters rowed per week, most recent first: [(YYYY-WW, meters), ...]
+    def weeklyMeters(self, weeks=52):
+        return self.db.execute("SELECT week, SUM(totalDistance) FROM sessions "
+                               "GROUP BY week ORDER BY week DESC LIMIT ?", (weeks,)).fetchall()
+
+    # Average pace, in secs / 500m, for a type of workout
+    def averagePace(self, intensity, duration=None, distance=None):
+        row = self.db.execute("SELECT SUM(totalTime) * ? / SUM(totalDistance) FROM sessions "
+                              "WHERE intensity = ? AND duration IS ? AND distance IS ? AND totalDistance > 0",
+                              (splitDistance, intensity, duration, distance)).fetchone()
+        return row[0]
+
+    # Fastest 500m split ever: (secs, session start) or None
+    def bestSplit(self):
+        return self.db.execute("SELECT sp.time, s.start FROM splits sp JOIN sessions s ON s.id = sp.session "
+                               "ORDER BY sp.time LIMIT 1").fetchone()
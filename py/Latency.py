@@ -0,0 +1,187 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# Latency tracing of the notification hot path, from the BLE callback to the pixels
+#
+# Each stage is timestamped with perf_counter_ns() and its latency recorded
+# in a fixed-size, log-linear (HDR-style) histogram.
+# Stages:
+#    interval   Time between two RowStatus1 notifications (BLE jitter)
+#    decode     Decoding the notification
+#    session    Session.update(), including the display model updates
+#    notify     Whole notification handler
+#    flush      Applying the pending widget updates (RenderModel.flush)
+#    pixels     From the oldest notification not yet rendered to the end of the flush
+#
+# Tracing is off by default: when disabled, each trace point costs a single test.
+#
+
+import array
+import time
+
+
+enabled = False
+
+now = time.perf_counter_ns
+
+#
+# Log-linear histogram of values in ns, with 'subBits' bits of precision (6% with 4 bits)
+# Values up to 2^maxBits ns (18 minutes) are recorded, larger ones are clamped.
+#
+class Histogram:
+
+    subBits = 4
+    maxBits = 40
+
+    def __init__(self):
+        self.subCount = 1 << Histogram.subBits
+        self.counts   = array.array('L', [0] * ((Histogram.maxBits - Histogram.subBits + 1) * self.subCount))
+        self.reset()
+
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.min   = None
+        self.max   = 0
+
+
+    def bucket(self, value):
+        if value < 2 * self.subCount:
+            return value
+        shift = value.bit_length() - Histogram.subBits - 1
+        return (shift + 1) * self.subCount + (value >> shift) - self.subCount
+
+
+    # Highest value in a bucket
+    def highest(self, idx):
+        if idx < 2 * self.subCount:
+            return idx
+        shift = idx // self.subCount - 1
+        return (((idx % self.subCount + self.subCount) + 1) << shift) - 1
+
+
+    def record(self, value):
+        if value < 0:
+            value = 0
+        elif value >= 1 << Histogram.maxBits:
+            value = (1 << Histogram.maxBits) - 1
+        self.counts[self.bucket(value)] += 1
+        self.count += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+
+    #
+    # Value at or below which 'p' percent of the recorded values fall (within the histogram precision)
+    #
+    def percentile(self, p):
+        if self.count == 0:
+            return 0
+        target = max(1, -(-self.count * p // 100))
+        seen = 0
+        for idx, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return min(self.highest(idx), self.max)
+        return self.max
+
+
+histograms = {}
+
+def histogram(stage):
+    h = histograms.get(stage)
+    if h is None:
+        h = histograms[stage] = Histogram()
+    return h
+
+
+#
+# Trace points
+#
+lastNotification = 0
+oldestPending    = 0
+
+#
+# A notification was received. Returns its timestamp, or 0 when tracing is disabled
+#
+def notified():
+    global lastNotification, oldestPending
+
+    if not enabled:
+        return 0
+    t = now()
+    if lastNotification:
+        histogram('interval').record(t - lastNotification)
+    lastNotification = t
+    if not oldestPending:
+        oldestPending = t
+    return t
+
+#
+# A stage that started at 'since' is done. Returns the current timestamp, to start the next stage
+#
+def stage(name, since):
+    if not since:
+        return 0
+    t = now()
+    histogram(name).record(t - since)
+    return t
+
+#
+# The display was updated with everything received so far
+#
+def rendered(since):
+    global oldestPending
+
+    if not since:
+        return
+    t = now()
+    histogram('flush').record(t - since)
+    if oldestPending:
+        histogram('pixels').record(t - oldestPending)
+        oldestPending = 0
+
+
+def start():
+    return now() if enabled else 0
+
+
+def reset():
+    global lastNotification, oldestPending
+
+    for h in histograms.values():
+        h.reset()
+    lastNotification = 0
+    oldestPending    = 0
+
+
+#
+# One line per stage: count, median, 99th percentile and maximum, in ms
+#
+def summary():
+    lines = []
+    for name in ('interval', 'decode', 'session', 'notify', 'flush', 'pixels'):
+        h = histograms.get(name)
+        if h is None or h.count == 0:
+            continue
+        lines.append("{:8s} n={:<6d} p50={:8.3f} p99={:8.3f} max={:8.3f} ms".format(name, h.count, h.percentile(50) / 1e6,
+                                                                                 h.percentile(99) / 1e6, h.max / 1e6))
+    return "\n".join(lines)
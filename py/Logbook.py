@@ -0,0 +1,321 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# Append-only, columnar log of the samples of a workout session
+#
+# Each session is a directory with one file per column, holding fixed-width values
+# in native (little-endian on the Pi) byte order, and a 'meta.json' file describing the session.
+# Samples are buffered in memory and appended to the column files every 'flushEvery' samples,
+# with an fsync() every 'fsyncInterval' seconds.
+#
+# The data of each stroke, and its force curve, are logged in two more tables of columns
+# (see strokeColumns and curveColumns). The force values of all the curves are appended to a single file.
+#
+# If power is lost, the column files may end up with different lengths:
+# the readable length of a table is the length of its shortest column.
+#
+# Finished sessions are read back via mmap, without copying.
+#
+
+import array
+import json
+import mmap
+import os
+import time
+
+
+#
+# Column name, array typecode, and PM5.Sample field (None for the time column)
+#
+columns = (('Time',         'I', None),             # ms since the start of the session
+           ('ElapsedTime',  'I', 'ElapsedTime'),    # 0.01 sec, PM-5 clock
+           ('Distance',     'I', 'Distance'),       # 0.1 m
+           ('Speed',        'H', 'Speed'),          # 0.001 m/s
+           ('StrokeRate',   'B', 'StrokeRate'),     # strokes/min
+           ('HeartBPM',     'B', 'HeartBPM'),       # bpm, 255 if none
+           ('Pace',         'H', 'Pace'),           # 0.01 sec / 500m
+           ('WorkoutState', 'B', 'WorkoutState'),
+           ('RowingState',  'B', 'RowingState'))
+
+#
+# Per-stroke columns, from the PM5.Sample after the stroke's last notification (StrokeData1)
+#
+strokeColumns = (('Time',           'I', None),             # ms since the start of the session
+                 ('ElapsedTime',    'I', 'ElapsedTime'),    # 0.01 sec, PM-5 clock
+                 ('StrokeCount',    'H', 'StrokeCount'),
+                 ('DriveLength',    'B', 'DriveLength'),    # 0.01 m
+                 ('DriveTime',      'B', 'DriveTime'),      # 0.01 sec
+                 ('RecoveryTime',   'H', 'RecoveryTime'),   # 0.01 sec
+                 ('StrokeDistance', 'H', 'StrokeDistance'), # 0.01 m
+                 ('PeakForce',      'H', 'PeakForce'),      # 0.1 lbs
+                 ('AvgForce',       'H', 'AvgForce'),       # 0.1 lbs
+                 ('WorkPerStroke',  'H', 'WorkPerStroke'),  # 0.1 J
+                 ('StrokePower',    'H', 'StrokePower'),    # watts
+                 ('StrokeCalories', 'H', 'StrokeCalories')) # cals/hr
+
+#
+# Per-curve columns. The force values (0.1 lbs) of each curve follow those of the previous one in 'Forces'.
+#
+curveColumns = (('Time',   'I', None),                      # ms since the start of the session
+                ('Length', 'B', None))                      # Number of force values
+
+forcesTypecode = 'H'
+
+
+def columnPath(sessionPath, name, table=None):
+    if table is not None:
+        name = table + "." + name
+    return os.path.join(sessionPath, name + ".col")
+
+
+#
+# Buffered column files of a table
+#
+class Table:
+
+    def __init__(self, sessionPath, table, columns):
+        self.buffers = [array.array(typecode) for name, typecode, field in columns]
+        self.files   = [open(columnPath(sessionPath, name, table), 'ab') for name, typecode, field in columns]
+        self.fields  = [field for name, typecode, field in columns]
+
+    def append(self, t, sample):
+        buffers = self.buffers
+        buffers[0].append(t)
+        for i in range(1, len(buffers)):
+            buffers[i].append(getattr(sample, self.fields[i]))
+
+    def flush(self):
+        for buffer, f in zip(self.buffers, self.files):
+            buffer.tofile(f)
+            del buffer[:]
+            f.flush()
+
+    def sync(self):
+        for f in self.files:
+            os.fsync(f.fileno())
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+
+def writeMeta(sessionPath, meta):
+    tmp = os.path.join(sessionPath, "meta.json.tmp")
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(sessionPath, "meta.json"))
+
+
+#
+# Create the directory of a new session, named after its start time.
+# Sessions started within the same second get a suffix, so they sort in order: "-1", "-2", ...
+#
+def newSessionPath(logDir):
+    os.makedirs(logDir, exist_ok=True)
+    name = time.strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(logDir, name)
+    n = 0
+    while True:
+        try:
+            os.mkdir(path)
+            return path
+        except FileExistsError:
+            n += 1
+            path = os.path.join(logDir, "{}-{:d}".format(name, n))
+
+
+class Writer:
+
+    def __init__(self, logDir, meta, flushEvery=20, fsyncInterval=30):
+        self.start = time.monotonic()
+        self.path  = newSessionPath(logDir)
+
+        self.meta = dict(meta)
+        self.meta['start']   = time.time()
+        self.meta['columns'] = [(name, typecode) for name, typecode, field in columns]
+        self.meta['strokeColumns'] = [(name, typecode) for name, typecode, field in strokeColumns]
+        self.meta['curveColumns']  = [(name, typecode) for name, typecode, field in curveColumns]
+        self.meta['closed']  = False
+        writeMeta(self.path, self.meta)
+
+        self.flushEvery    = flushEvery
+        self.fsyncInterval = fsyncInterval
+        self.lastSync      = self.start
+        self.count         = 0
+
+        self.samples = Table(self.path, None, columns)
+        self.strokes = Table(self.path, "strokes", strokeColumns)
+        self.curves  = Table(self.path, "curves", curveColumns)
+        self.forces  = array.array(forcesTypecode)
+        self.forcesFile = open(columnPath(self.path, "Forces", "curves"), 'ab')
+
+
+    def append(self, sample, now=None):
+        if now is None:
+            now = time.monotonic()
+
+        self.samples.append(int((now - self.start) * 1000), sample)
+
+        self.count += 1
+        if len(self.samples.buffers[0]) >= self.flushEvery:
+            self.flush(now)
+
+
+    #
+    # Strokes and force curves are only written with the samples
+    #
+    def appendStroke(self, sample, now=None):
+        if now is None:
+            now = time.monotonic()
+        self.strokes.append(int((now - self.start) * 1000), sample)
+
+
+    def appendForceCurve(self, forces, now=None):
+        if now is None:
+            now = time.monotonic()
+        forces = forces[:255]
+        self.curves.buffers[0].append(int((now - self.start) * 1000))
+        self.curves.buffers[1].append(len(forces))
+        self.forces.extend(forces)
+
+
+    def flush(self, now=None, sync=False):
+        if now is None:
+            now = time.monotonic()
+
+        # The forces are written before their curve, so a curve is never readable without its forces
+        self.forces.tofile(self.forcesFile)
+        del self.forces[:]
+        self.forcesFile.flush()
+        for table in (self.samples, self.strokes, self.curves):
+            table.flush()
+
+        if sync or now - self.lastSync >= self.fsyncInterval:
+            os.fsync(self.forcesFile.fileno())
+            for table in (self.samples, self.strokes, self.curves):
+                table.sync()
+            self.lastSync = now
+
+
+    def close(self, summary=None):
+        self.flush(sync=True)
+        self.forcesFile.close()
+        for table in (self.samples, self.strokes, self.curves):
+            table.close()
+
+        self.meta['closed'] = True
+        self.meta['samples'] = self.count
+        if summary is not None:
+            self.meta.update(summary)
+        writeMeta(self.path, self.meta)
+
+
+#
+# A recorded session, with each column available as a memoryview of the mmap'ed column file
+#
+class Reader:
+
+    def __init__(self, sessionPath):
+        self.path = sessionPath
+        with open(os.path.join(sessionPath, "meta.json")) as f:
+            self.meta = json.load(f)
+
+        self.maps    = []
+        self.views   = []
+        self.columns, self.count = self.readTable(None, self.meta['columns'])
+
+        # Sessions logged before strokes were recorded have no stroke or curve tables
+        self.strokes, self.strokeCount = self.readTable("strokes", self.meta.get('strokeColumns', []))
+        self.curves,  self.curveCount  = self.readTable("curves",  self.meta.get('curveColumns', []))
+        self.forces  = self.readColumn(columnPath(sessionPath, "Forces", "curves"), forcesTypecode)
+        self.offsets = [0]
+        if self.curveCount > 0:
+            for length in self.curves['Length']:
+                if self.offsets[-1] + length > len(self.forces):
+                    break
+                self.offsets.append(self.offsets[-1] + length)
+            self.curveCount = len(self.offsets) - 1
+
+
+    def readColumn(self, path, typecode):
+        if not os.path.exists(path):
+            view = memoryview(array.array(typecode))
+        else:
+            itemSize = array.array(typecode).itemsize
+            with open(path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                n    = size // itemSize
+                if n == 0:
+                    view = memoryview(array.array(typecode))
+                else:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    self.maps.append(mm)
+                    view = memoryview(mm)[:n * itemSize].cast(typecode)
+        self.views.append(view)
+        return view
+
+
+    #
+    # Return the columns of a table, truncated to the shortest, and its length
+    #
+    def readTable(self, table, tableColumns):
+        views = {name: self.readColumn(columnPath(self.path, name, table), typecode) for name, typecode in tableColumns}
+        if len(views) == 0:
+            return {}, 0
+        count = min([len(view) for view in views.values()])
+        for name, view in views.items():
+            views[name] = view[:count]
+            self.views.append(views[name])
+        return views, count
+
+
+    def __len__(self):
+        return self.count
+
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+
+    # Force values of the i'th curve, as a list
+    def curve(self, i):
+        return self.forces[self.offsets[i]:self.offsets[i+1]].tolist()
+
+
+    def close(self):
+        for view in reversed(self.views):
+            view.release()
+        self.views   = []
+        self.columns = {}
+        self.strokes = {}
+        self.curves  = {}
+        self.forces  = None
+        for mm in self.maps:
+            mm.close()
+        self.maps = []
+
+
+#
+# List the sessions in a log directory, oldest first
+#
+def sessions(logDir):
+    if not os.path.isdir(logDir):
+        return []
+    return [os.path.join(logDir, d) for d in sorted(os.listdir(logDir))
+            if os.path.exists(os.path.join(logDir, d, "meta.json"))]
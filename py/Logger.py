@@ -0,0 +1,112 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# Leveled logging, per subsystem
+#
+# Each subsystem logs to its own logger (see get()) so its level can be set independently
+# (see User.logLevels and the '-v' command-line option).
+# Log records are only queued by the caller: formatting and I/O are done by a background listener thread,
+# so logging never blocks the event loop. Hot-path messages must be guarded with isEnabledFor()
+# so they cost a single check when disabled.
+#
+# PM-5 samples are never dumped as text: the raw notifications are recorded in binary form
+# (see Replay.Recorder) when the 'PM5' subsystem is at the DEBUG level.
+#
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+
+
+root = "pROWess"
+
+# Where the raw PM-5 notifications are recorded at the DEBUG level
+samplePath = os.path.expanduser("~/.pROWess/pm5-debug.rec")
+
+listener = None
+
+
+def get(subsystem):
+    return logging.getLogger(root + "." + subsystem)
+
+
+#
+# Queue the records as-is: they are formatted by the listener thread.
+# The arguments of a message must therefore not be modified after it is logged.
+#
+class QueueHandler(logging.handlers.QueueHandler):
+
+    def prepare(self, record):
+        if record.exc_info:
+            return super().prepare(record)
+        return record
+
+
+#
+# Parse a 'subsystem=LEVEL' (or 'subsystem', for DEBUG) command-line option into 'levels'
+#
+def parseLevel(option, levels):
+    name, sep, level = option.partition('=')
+    if not sep:
+        level = "DEBUG"
+    levels[name] = level.upper()
+
+
+#
+# Start logging, with the level of each subsystem. The '' subsystem sets the default level.
+# Messages are written to stderr and, optionally, to a rotating log file.
+#
+def setup(levels, logPath=None):
+    global listener
+
+    stop()
+
+    formatter = logging.Formatter("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+    handlers  = [logging.StreamHandler()]
+    if logPath is not None:
+        os.makedirs(os.path.dirname(logPath), exist_ok=True)
+        handlers.append(logging.handlers.RotatingFileHandler(logPath, maxBytes=1024*1024, backupCount=3))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+
+    logger = logging.getLogger(root)
+    logger.handlers = [QueueHandler(records)]
+    logger.propagate = False
+    for name, level in levels.items():
+        if name == '':
+            logger.setLevel(level)
+        else:
+            get(name).setLevel(level)
+
+
+#
+# Flush and stop the listener
+#
+def stop():
+    global listener
+
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+atexit.register(stop)
@@ -0,0 +1,271 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# PM-5 BLE characteristics and the decoders for their notifications
+#
+
+import struct
+import uuid
+
+
+#
+# All PM-5 characteristics share the same base UUID, only the 16-bit short UUID varies
+#
+def c2UUID(shortUUID):
+    return uuid.UUID('{{ce06{:04x}-43e5-11e4-916c-0800200c9a66}}'.format(shortUUID))
+
+
+PM5UUID = {'getSerial'  : c2UUID(0x0012),
+           'sendCSAFE'  : c2UUID(0x0021),
+           'getCSAFE'   : c2UUID(0x0022)}
+
+
+#
+# The latest value of every field decoded from the PM-5 notifications.
+# A single instance is allocated up-front and overwritten in place by the decoders
+# so nothing gets allocated per notification.
+#
+class Sample:
+    __slots__ = ('ElapsedTime', 'Distance', 'WorkoutType', 'IntervalType', 'WorkoutState',
+                 'RowingState', 'StrokeState', 'TotalDistance', 'Duration', 'DurationType',
+                 'DragFactor', 'Speed', 'StrokeRate', 'HeartBPM', 'Pace', 'AvgPace',
+                 'RestDist', 'RestTime', 'MachineType',
+                 # Additional status 2
+                 'IntervalCount', 'AvgPower', 'TotalCalories', 'SplitAvgPace', 'SplitAvgPower',
+                 'SplitAvgCalories', 'LastSplitTime', 'LastSplitDistance',
+                 # Stroke data
+                 'DriveLength', 'DriveTime', 'RecoveryTime', 'StrokeDistance', 'PeakForce',
+                 'AvgForce', 'WorkPerStroke', 'StrokeCount', 'StrokePower', 'StrokeCalories',
+                 'ProjectedWorkTime', 'ProjectedWorkDistance',
+                 # Split/interval data
+                 'SplitTime', 'SplitDistance', 'IntervalRestTime', 'IntervalRestDistance',
+                 'SplitType', 'SplitNumber', 'SplitStrokeRate', 'SplitWorkHeartRate',
+                 'SplitRestHeartRate', 'SplitPace', 'SplitCalories', 'SplitCaloriesRate',
+                 'SplitSpeed', 'SplitPower', 'SplitDragFactor')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def asDict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return repr(self.asDict())
+
+
+#
+# Decode a notification described by a table of (field name, number of bytes) tuples,
+# in the order they appear in the notification. All fields are little-endian, unsigned.
+# 24-bit fields are unpacked as a 16-bit and an 8-bit value then combined.
+#
+# The table is compiled once into a precompiled struct.Struct and a straight-line
+# decode function (the way collections.namedtuple used to do it) so decoding a
+# notification is a single unpack_from() and a series of slot assignments.
+#
+class Decoder:
+    formats = {1: 'B', 2: 'H', 4: 'I'}
+
+    def __init__(self, fields):
+        fmt   = '<'
+        body  = []
+        idx   = 0
+        for name, nBytes in fields:
+            if name not in Sample.__slots__:
+                raise ValueError("Unknown PM-5 sample field '" + name + "'")
+            if nBytes == 3:
+                fmt += 'HB'
+                body.append("    sample.{} = vals[{}] | (vals[{}] << 16)".format(name, idx, idx + 1))
+                idx += 2
+            else:
+                fmt += Decoder.formats[nBytes]
+                body.append("    sample.{} = vals[{}]".format(name, idx))
+                idx += 1
+
+        self.fields = tuple(fields)
+        self.struct = struct.Struct(fmt)
+        self.size   = self.struct.size
+
+        src = "def decode(val, sample):\n    vals = unpack_from(val)\n" + "\n".join(body) + "\n    return sample\n"
+        namespace = {'unpack_from': self.struct.unpack_from}
+        exec(src, namespace)
+        # Decode the notification bytes into the specified sample record
+        self.decode = namespace['decode']
+
+    # Encode the relevant fields of a sample record into notification bytes
+    def encode(self, sample):
+        vals = []
+        for name, nBytes in self.fields:
+            val = getattr(sample, name)
+            if nBytes == 3:
+                vals.append(val & 0xFFFF)
+                vals.append(val >> 16)
+            else:
+                vals.append(val)
+        return self.struct.pack(*vals)
+
+
+#
+# Registry of the PM-5 characteristics and their decoders, keyed by UUID
+# Characteristics without a decoder (e.g. written to, or variable-length) have no fields table
+#
+decoders = {}
+
+def register(name, shortUUID, fields=None):
+    charUUID = c2UUID(shortUUID)
+    PM5UUID[name] = charUUID
+    if fields is not None:
+        decoders[charUUID] = Decoder(fields)
+    return charUUID
+
+
+register('RowStatus',   0x0031, (('ElapsedTime',          3),    # 0.01 sec
+                                 ('Distance',             3),    # 0.1 m
+                                 ('WorkoutType',          1),
+                                 ('IntervalType',         1),
+                                 ('WorkoutState',         1),
+                                 ('RowingState',          1),
+                                 ('StrokeState',          1),
+                                 ('TotalDistance',        3),    # 1 m
+                                 ('Duration',             3),
+                                 ('DurationType',         1),
+                                 ('DragFactor',           1)))
+
+register('RowStatus1',  0x0032, (('ElapsedTime',          3),    # 0.01 sec
+                                 ('Speed',                2),    # 0.001 m/s
+                                 ('StrokeRate',           1),    # strokes/min
+                                 ('HeartBPM',             1),    # 255 if no HR monitor
+                                 ('Pace',                 2),    # 0.01 sec / 500m
+                                 ('AvgPace',              2),    # 0.01 sec / 500m
+                                 ('RestDist',             2),    # 1 m
+                                 ('RestTime',             3),    # 0.01 sec
+                                 ('MachineType',          1)))
+
+register('RowStatus2',  0x0033, (('ElapsedTime',          3),    # 0.01 sec
+                                 ('IntervalCount',        1),
+                                 ('AvgPower',             2),    # watts
+                                 ('TotalCalories',        2),    # cals
+                                 ('SplitAvgPace',         2),    # 0.01 sec / 500m
+                                 ('SplitAvgPower',        2),    # watts
+                                 ('SplitAvgCalories',     2),    # cals/hr
+                                 ('LastSplitTime',        3),    # 0.1 sec
+                                 ('LastSplitDistance',    3)))   # 1 m
+
+# Write-only: rate of the status notifications
+register('SampleRate',  0x0034)
+
+register('StrokeData',  0x0035, (('ElapsedTime',          3),    # 0.01 sec
+                                 ('Distance',             3),    # 0.1 m
+                                 ('DriveLength',          1),    # 0.01 m
+                                 ('DriveTime',            1),    # 0.01 sec
+                                 ('RecoveryTime',         2),    # 0.01 sec
+                                 ('StrokeDistance',       2),    # 0.01 m
+                                 ('PeakForce',            2),    # 0.1 lbs
+                                 ('AvgForce',             2),    # 0.1 lbs
+                                 ('WorkPerStroke',        2),    # 0.1 J
+                                 ('StrokeCount',          2)))
+
+register('StrokeData1', 0x0036, (('ElapsedTime',          3),    # 0.01 sec
+                                 ('StrokePower',          2),    # watts
+                                 ('StrokeCalories',       2),    # cals/hr
+                                 ('StrokeCount',          2),
+                                 ('ProjectedWorkTime',    3),    # 1 sec
+                                 ('ProjectedWorkDistance', 3)))  # 1 m
+
+register('SplitData',   0x0037, (('ElapsedTime',          3),    # 0.01 sec
+                                 ('Distance',             3),    # 0.1 m
+                                 ('SplitTime',            3),    # 0.1 sec
+                                 ('SplitDistance',        3),    # 1 m
+                                 ('IntervalRestTime',     2),    # 1 sec
+                                 ('IntervalRestDistance', 2),    # 1 m
+                                 ('SplitType',            1),
+                                 ('SplitNumber',          1)))
+
+register('SplitData1',  0x0038, (('ElapsedTime',          3),    # 0.01 sec
+                                 ('SplitStrokeRate',      1),    # strokes/min
+                                 ('SplitWorkHeartRate',   1),    # bpm
+                                 ('SplitRestHeartRate',   1),    # bpm
+                                 ('SplitPace',            2),    # 0.1 sec / 500m
+                                 ('SplitCalories',        2),    # cals
+                                 ('SplitCaloriesRate',    2),    # cals/hr
+                                 ('SplitSpeed',           2),    # 0.001 m/s
+                                 ('SplitPower',           2),    # watts
+                                 ('SplitDragFactor',      1),
+                                 ('SplitNumber',          1),
+                                 ('MachineType',          1)))
+
+# Variable-length: see ForceCurve
+register('ForceCurve',  0x003D)
+
+
+#
+# Status notification sample rate (0x0034 values), and the rate used for each type of workout.
+# Faster rates give finer-grained data at the expense of CPU time on the Pi.
+#
+SampleRate = {'1s':    0,
+              '500ms': 1,
+              '250ms': 2,
+              '100ms': 3}
+
+sampleRateByIntensity = {'Easy':      SampleRate['1s'],
+                         'Normal':    SampleRate['500ms'],
+                         'Intense':   SampleRate['250ms'],
+                         'Interval':  SampleRate['250ms'],
+                         'Cardio':    SampleRate['500ms'],
+                         'Strength':  SampleRate['250ms']}
+
+def sampleRate(intensity):
+    return sampleRateByIntensity.get(intensity, SampleRate['500ms'])
+
+
+#
+# Force curve for a stroke, reassembled from a series of 0x003D notifications.
+# The first byte of each notification has the total number of notifications for that stroke
+# in its upper nibble and the number of 16-bit force values (0.1 lbs) it carries in its lower nibble.
+# The second byte is a sequence number.
+#
+class ForceCurve:
+    __slots__ = ('forces', 'count', 'received', 'expected')
+
+    maxValues = 16 * 9
+    unpackers = [struct.Struct('<' + 'H' * n).unpack_from for n in range(16)]
+
+    def __init__(self):
+        self.forces   = [0] * ForceCurve.maxValues
+        self.reset()
+
+    def reset(self):
+        self.count    = 0
+        self.received = 0
+        self.expected = 0
+
+    # Add a notification. Returns True when the curve for the stroke is complete.
+    def add(self, val):
+        expected = val[0] >> 4
+        nWords   = val[0] & 0x0F
+        if self.received == 0 or self.received >= self.expected:
+            self.reset()
+            self.expected = expected
+
+        count = self.count
+        self.forces[count:count + nWords] = ForceCurve.unpackers[nWords](val, 2)
+        self.count    = count + nWords
+        self.received += 1
+        return self.received >= self.expected
+
+    def values(self):
+        return self.forces[:self.count]
@@ -0,0 +1,173 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# Record and replay the raw PM-5 BLE notifications of a rowing session
+#
+# The recording is a binary file with a 5-byte header ("PRWR" + version)
+# followed by one record per notification:
+#
+#     uint32  microseconds since the previous notification (monotonic clock)
+#     uint16  short UUID of the characteristic (e.g. 0x0032)
+#     uint8   number of bytes in the notification
+#     ...     raw notification bytes
+#
+# Usage:
+#     python3 Replay.py testdata.log session.rec [repeat]
+#         Convert the stats dicts printed in a log file into a recording
+#
+
+import ast
+import struct
+import sys
+import time
+
+import PM5
+from PM5 import PM5UUID
+
+
+MAGIC  = b'PRWR\x01'
+record = struct.Struct('<IHB')
+
+maxDelta = 0xFFFFFFFF
+
+
+def shortUUID(charUUID):
+    return (charUUID.int >> 96) & 0xFFFF
+
+
+class Recorder:
+
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.last = None
+
+
+    def record(self, charUUID, val, nowNs=None):
+        if nowNs is None:
+            nowNs = time.monotonic_ns()
+        delta = 0
+        if self.last is not None:
+            delta = min((nowNs - self.last) // 1000, maxDelta)
+        self.last = nowNs
+
+        self.file.write(record.pack(delta, shortUUID(charUUID), len(val)))
+        self.file.write(val)
+
+
+    # Return a notification handler that records the notification before passing it on
+    def wrap(self, charUUID, handler):
+        def recordingHandler(charHandle, val):
+            self.record(charUUID, val)
+            handler(charHandle, val)
+        return recordingHandler
+
+
+    def flush(self):
+        self.file.flush()
+
+
+    def close(self):
+        self.file.close()
+
+
+class Replayer:
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        if not self.data.startswith(MAGIC):
+            raise ValueError(path + " is not a pROWess recording")
+
+
+    #
+    # Iterate over (microseconds since start, characteristic UUID, notification bytes)
+    #
+    def __iter__(self):
+        uuids = {}
+        data  = memoryview(self.data)
+        now   = 0
+        i     = len(MAGIC)
+        while i + record.size <= len(data):
+            delta, short, nBytes = record.unpack_from(data, i)
+            i += record.size
+            if short not in uuids:
+                uuids[short] = PM5.c2UUID(short)
+            now += delta
+            yield now, uuids[short], data[i:i + nBytes]
+            i += nBytes
+
+
+    #
+    # Feed the notifications to the handler for their characteristic, as if they came from the PM-5.
+    # 'speed' is the replay speed-up factor. Use 0 to replay as fast as possible.
+    # 'idle' is called before waiting for the next notification (e.g. to refresh the display).
+    # Returns the number of notifications replayed and the wall-clock duration of the replay.
+    #
+    def replay(self, handlers, speed=1, idle=None):
+        count = 0
+        start = time.monotonic()
+        for when, charUUID, val in self:
+            if speed > 0:
+                delay = start + when / 1e6 / speed - time.monotonic()
+                if delay > 0:
+                    if idle is not None:
+                        idle()
+                        delay = start + when / 1e6 / speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+            if charUUID in handlers:
+                handlers[charUUID](shortUUID(charUUID), val)
+                count += 1
+
+        return count, time.monotonic() - start
+
+
+#
+# Convert the stats dicts printed by decodeRowingStatus1() into a recording,
+# with a RowStatus and RowStatus1 notification every 'interval' seconds.
+#
+def fromStatsLog(logPath, recPath, interval=0.5, repeat=1):
+    statuses = [(PM5UUID[name], PM5.decoders[PM5UUID[name]]) for name in ('RowStatus', 'RowStatus1')]
+    sample = PM5.Sample()
+    recorder = Recorder(recPath)
+
+    nowNs = 0
+    offset = 0
+    for i in range(repeat):
+        lastElapsedTime = 0
+        with open(logPath) as f:
+            for line in f:
+                stats = ast.literal_eval(line)
+                for name, val in stats.items():
+                    setattr(sample, name, val)
+                # Keep the PM-5 counters increasing across repeats
+                sample.ElapsedTime += offset
+                lastElapsedTime = sample.ElapsedTime
+                for charUUID, decoder in statuses:
+                    recorder.record(charUUID, decoder.encode(sample), nowNs)
+                nowNs += int(interval * 1e9)
+        offset = lastElapsedTime
+
+    recorder.close()
+
+
+if __name__ == "__main__":
+    repeat = 1
+    if len(sys.argv) > 3:
+        repeat = int(sys.argv[3])
+    fromStatsLog(sys.argv[1], sys.argv[2], repeat=repeat)
@@ -0,0 +1,134 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# Report the state of the Pi to the IoT shadow without blocking the caller
+#
+# Reports are queued and sent by a background thread. Only the latest reported state matters,
+# so a report that has not been sent yet is replaced by any newer one.
+# Failed updates are retried with an exponential backoff.
+#
+# Only the keys that changed since the last accepted report are sent.
+# The desired state is not echoed back: it is cleared instead, once a request has been consumed,
+# so it cannot trigger a delta again.
+#
+
+import json
+import threading
+
+import Logger
+
+
+log = Logger.get("AWS")
+
+
+class ShadowReporter:
+
+    def __init__(self, timeout=5, minBackoff=1, maxBackoff=32):
+        self.timeout    = timeout
+        self.minBackoff = minBackoff
+        self.maxBackoff = maxBackoff
+
+        self.handler    = None
+        self.pending    = None
+        self.clear      = False
+        self.reported   = None
+        self.condition  = threading.Condition()
+
+        threading.Thread(target=self.run, daemon=True).start()
+
+
+    #
+    # Reports are held until the shadow handler is available.
+    # The whole state is reported on a new connection.
+    #
+    def setHandler(self, shadowHandler):
+        with self.condition:
+            self.handler  = shadowHandler
+            self.reported = None
+            self.condition.notify()
+
+
+    #
+    # Queue a state report, optionally clearing the desired state. Never blocks.
+    # A pending request to clear the desired state is kept when the report is replaced.
+    #
+    def report(self, state, clearDesired=False):
+        with self.condition:
+            self.pending = dict(state)
+            self.clear   = self.clear or clearDesired
+            self.condition.notify()
+
+
+    def takePending(self):
+        state, clear = self.pending, self.clear
+        self.pending = None
+        self.clear   = False
+        return state, clear
+
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None or self.handler is None:
+                    self.condition.wait()
+                state, clear = self.takePending()
+
+            backoff = self.minBackoff
+            while not self.send(state, clear):
+                with self.condition:
+                    self.condition.wait(backoff)
+                    # Latest state wins
+                    if self.pending is not None:
+                        state, clearToo = self.takePending()
+                        clear = clear or clearToo
+                backoff = min(2 * backoff, self.maxBackoff)
+
+
+    #
+    # Send the changes to the state and wait for them to be accepted
+    #
+    def send(self, state, clearDesired):
+        if self.reported is None:
+            changes = state
+        else:
+            changes = {key: value for key, value in state.items() if self.reported.get(key) != value}
+        if not changes and not clearDesired:
+            return True
+
+        update = {'state': {'reported': changes}}
+        if clearDesired:
+            update['state']['desired'] = None
+
+        done   = threading.Event()
+        status = []
+
+        def updated(payload, responseStatus, token):
+            status.append(responseStatus)
+            done.set()
+
+        try:
+            self.handler.shadowUpdate(json.dumps(update), updated, self.timeout)
+        except Exception as err:
+            log.warning("Shadow update failed: %s", err)
+            return False
+
+        done.wait(self.timeout + 1)
+        if status != ["accepted"]:
+            log.warning("Shadow update %s", status[0] if status else "timed out")
+            return False
+        self.reported = state
+        return True
@@ -0,0 +1,204 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# Publish live workout telemetry over MQTT
+#
+# Per-stroke samples are packed into fixed-size binary records and published in batches,
+# when 'maxSamples' samples have accumulated or every 'maxInterval' seconds, whichever comes first.
+# Batches that cannot be published (e.g. while offline) are spooled to disk
+# and published, oldest first, once the connection is back.
+#
+# Payload: header, followed by 'count' records
+#     uint8   version
+#     uint8   record size, in bytes
+#     uint16  count
+#     uint32  UNIX time when the batch was sent
+# Record:
+#     uint32  elapsed time (0.01 sec)
+#     uint32  distance (0.1 m)
+#     uint16  stroke count
+#     uint8   stroke rate (strokes/min)
+#     uint8   heart rate (bpm, 255 if none)
+#     uint16  pace (0.01 sec / 500m)
+#     uint16  stroke power (watts)
+#     uint8   drive length (0.01 m)
+#     uint8   drive time (0.01 sec)
+#     uint16  peak drive force (0.1 lbs)
+#     uint16  average drive force (0.1 lbs)
+#
+# The MQTT connection only needs a publish(topic, payload, QoS) method returning True on success,
+# like AWSIoTPythonSDK's AWSIoTMQTTClient.
+#
+
+import os
+import struct
+import threading
+import time
+
+import Logger
+
+
+log = Logger.get("Telemetry")
+
+
+VERSION = 1
+
+header = struct.Struct('<BBHI')
+record = struct.Struct('<IIHBBHHBBHH')
+length = struct.Struct('<I')
+
+recordFields = ('ElapsedTime', 'Distance', 'StrokeCount', 'StrokeRate', 'HeartBPM', 'Pace',
+                'StrokePower', 'DriveLength', 'DriveTime', 'PeakForce', 'AvgForce')
+
+
+#
+# Decode a payload into a list of per-stroke dicts
+#
+def decode(payload):
+    version, size, count, when = header.unpack_from(payload)
+    return [dict(zip(recordFields, record.unpack_from(payload, header.size + i * size))) for i in range(count)]
+
+
+class Publisher:
+
+    def __init__(self, topic, spoolPath, maxSamples=32, maxInterval=30, maxSpool=4*1024*1024, qos=1):
+        self.topic       = topic
+        self.spoolPath   = spoolPath
+        self.maxSamples  = maxSamples
+        self.maxInterval = maxInterval
+        self.maxSpool    = maxSpool
+        self.qos         = qos
+
+        self.connection  = None
+        self.batch       = bytearray(header.size + maxSamples * record.size)
+        self.count       = 0
+        # Batches ready to be published
+        self.ready       = []
+        self.condition   = threading.Condition()
+
+        threading.Thread(target=self.run, daemon=True).start()
+
+
+    def setConnection(self, connection):
+        with self.condition:
+            self.connection = connection
+            self.condition.notify()
+
+
+    #
+    # Add a sample (a PM5.Sample) to the current batch. Never blocks on the network.
+    #
+    def add(self, sample):
+        with self.condition:
+            record.pack_into(self.batch, header.size + self.count * record.size,
+                             sample.ElapsedTime, sample.Distance, sample.StrokeCount,
+                             sample.StrokeRate, sample.HeartBPM, sample.Pace, sample.StrokePower,
+                             sample.DriveLength, sample.DriveTime, sample.PeakForce, sample.AvgForce)
+            self.count += 1
+            if self.count >= self.maxSamples:
+                self.ready.append(self.take())
+                self.condition.notify()
+
+
+    #
+    # Publish the current batch right away (e.g. at the end of a workout)
+    #
+    def flush(self):
+        with self.condition:
+            if self.count > 0:
+                self.ready.append(self.take())
+            self.condition.notify()
+
+
+    # Must be called with the condition held
+    def take(self):
+        header.pack_into(self.batch, 0, VERSION, record.size, self.count, int(time.time()))
+        payload = bytes(self.batch[:header.size + self.count * record.size])
+        self.count = 0
+        return payload
+
+
+    def run(self):
+        while True:
+            with self.condition:
+                if len(self.ready) == 0:
+                    self.condition.wait(self.maxInterval)
+                # Publish partial batches at least every 'maxInterval' seconds
+                if self.count > 0:
+                    self.ready.append(self.take())
+                ready = self.ready
+                self.ready = []
+                connection = self.connection
+
+            # Oldest first
+            if connection is None or not self.drainSpool(connection):
+                for payload in ready:
+                    self.spool(payload)
+                continue
+
+            for i in range(len(ready)):
+                if not self.publish(connection, ready[i]):
+                    for payload in ready[i:]:
+                        self.spool(payload)
+                    break
+
+
+    def publish(self, connection, payload):
+        try:
+            return connection.publish(self.topic, payload, self.qos)
+        except Exception as err:
+            log.warning("Telemetry publish failed: %s", err)
+            return False
+
+
+    #
+    # Batches that could not be published are appended to the spool file, prefixed by their length
+    #
+    def spool(self, payload):
+        try:
+            if os.path.exists(self.spoolPath) and os.path.getsize(self.spoolPath) + len(payload) > self.maxSpool:
+                return
+            with open(self.spoolPath, 'ab') as f:
+                f.write(length.pack(len(payload)))
+                f.write(payload)
+        except OSError as err:
+            log.warning("Cannot spool telemetry: %s", err)
+
+
+    # Returns True if the spool is now empty
+    def drainSpool(self, connection):
+        if not os.path.exists(self.spoolPath):
+            return True
+
+        with open(self.spoolPath, 'rb') as f:
+            data = f.read()
+
+        i = 0
+        while i + length.size <= len(data):
+            n = length.unpack_from(data, i)[0]
+            if not self.publish(connection, data[i + length.size:i + length.size + n]):
+                break
+            i += length.size + n
+
+        # Keep what could not be sent for next time
+        if i >= len(data):
+            os.remove(self.spoolPath)
+            return True
+        if i > 0:
+            with open(self.spoolPath, 'wb') as f:
+                f.write(data[i:])
+        return False
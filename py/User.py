@@ -14,6 +14,7 @@
 # limitations under the License.
 #
 
+import os
 
 #
 # User profile variables
@@ -26,6 +27,27 @@ metersInOneKm = 1000
 # Size of the display windoe
 screen = {'X': 1680, 'Y': 1050, 'DPI': 90}
 
+# Maximum display refresh rate
+displayFPS = 5
+
+# Where workouts are logged
+logDir = os.path.expanduser("~/.pROWess/log")
+historyPath = os.path.expanduser("~/.pROWess/history.db")
+
+# Log level of each subsystem ('' for the default) and log file
+logLevels = {'': "INFO", 'PM5': "INFO", 'AWS': "INFO", 'Workout': "INFO", 'Telemetry': "WARNING"}
+logPath = os.path.expanduser("~/.pROWess/pROWess.log")
+
+# Trace the latency of the notification hot path, and how often to log it (in secs)
+traceLatency = False
+latencyDumpInterval = 60
+
+# Stay connected to the PM-5 between workouts (faster start, but keeps the PM-5 awake)
+keepPM5Connected = False
+
+# Maximum heart rate, for the heart rate zones of the post-workout analytics
+maxHeartRate = 185
+
 # Average 500m split time, in seconds, to estimate reset time during distance intervals
 splitTime = 2*60+30
 
@@ -15,13 +15,30 @@
 #
 
 import asyncio
+import shutil
 import time
 
+import History
+import Logbook
+import Logger
 import User
 
 
+log = Logger.get("Workout")
+
+
+#
+# Pause timeouts are measured with a monotonic clock: workout time and distance come from the PM-5
+#
 def now():
-    return int(time.time())
+    return time.monotonic()
+
+
+#
+# A free phase has neither a duration nor a distance: it lasts until rowing stops
+#
+def isFree(phase):
+    return phase.get('duration') is None and phase.get('distance') is None
 
 
 class State:
@@ -102,16 +119,31 @@ class Session():
         self.display  = display
         self.phases   = []
         self.state    = State()
-        self.newPhase = None
+        # Commands to the PM-5 writer: the next phase to program, or None at the end of the workout
+        self.commands = asyncio.Queue()
+        self.ended    = False
+        self.intensity = None
+        self.lastElapsedTime = None
+        # Log of all the samples in the session
+        self.logbook     = None
+        # Logs closed, but not yet indexed and analyzed (see processLog())
+        self.closedLogs  = []
 
 
-    def setFuture(self, newPhase):
-        self.newPhase = newPhase
-        
-
     # A workout is composed of a series of phases. Each phase ends up being programmed (and run) as a separate
     # workout in the PM-5. Warm-up and cool-down phases are automatically added.
     def createPhases(self, intensity, duration, distance):
+        self.intensity   = intensity
+        # Start with a fresh command queue so nothing left over from a previous workout is sent
+        self.commands    = asyncio.Queue()
+        self.ended       = False
+
+        self.closeLog()
+        try:
+            self.logbook = Logbook.Writer(User.logDir, {'intensity': intensity, 'duration': duration, 'distance': distance})
+        except OSError as err:
+            log.warning("Cannot log workout: %s", err)
+
         if intensity == "TestProgram":
 
             self.phases = [{'name':     "Test Warm-up",
@@ -128,7 +160,11 @@ class Session():
                             'repeat':   0}]
             
         else:
-            if duration is None:
+            if duration is None and distance is None:
+                self.phases = [{'name':     intensity + " Row",
+                                'restTime': 0,
+                                'repeat':   1}]
+            elif distance is None:
                 self.phases = [{'name':     "Timed " + intensity,
                                 'duration': duration,
                                 'restTime': 0,
@@ -157,7 +193,10 @@ class Session():
             return None
         
         phase = self.phases.pop(0)
-        if 'duration' in phase:
+        if isFree(phase):
+            self.display.configureEndGoal(None, None)
+            self.display.configurePhase(None, None)
+        elif 'duration' in phase:
             self.display.configureEndGoal((phase['duration'] + phase['restTime']) * phase['repeat'], None);
             self.display.configurePhase((phase['duration'] + phase['restTime']) * phase['repeat'], None)
         else: 
@@ -168,8 +207,23 @@ class Session():
         self.state.reset()
         return phase
 
-    def update(self, speed, strokeRate, heartRate):
-        rc = None
+    #
+    # Update the session with the latest PM5.Sample
+    # The elapsed time and distance are the PM-5's own counters (see PM5 RowStatus and RowStatus1)
+    # Phase changes are queued to the PM-5 writer (see commands)
+    #
+    def update(self, sample):
+        if self.logbook is not None:
+            self.logbook.append(sample)
+
+        speed      = sample.Speed / 1000
+        strokeRate = sample.StrokeRate
+        heartRate  = sample.HeartBPM
+
+        # When rowing stops, elasped time stops, but speed keeps the last value
+        if speed > 0 and sample.ElapsedTime == self.lastElapsedTime:
+            speed = 0
+        self.lastElapsedTime = sample.ElapsedTime
         
         self.display.heartBeat()
 
@@ -184,27 +238,85 @@ class Session():
                 self.display.resume()
             if stateChange == State.STOPPED:
                 self.display.stop()
+                self.closeLog()
+                self.endWorkout()
                                 
         self.display.updateStrokeRate(strokeRate)
-        if self.display.updateSpeed(speed):
+        if self.display.updateProgress(sample.ElapsedTime / 100, sample.Distance / 10, speed):
             # Move to the next split
             if len(self.phases) > 0:
-                # Return the new program to send to the PM-5
-                rc = self.phases[0]
-                self.startNextPhase()
+                # Program the new phase in the PM-5
+                self.commands.put_nowait(self.startNextPhase())
             else:
                 self.abort()
                 
         self.display.updateHeartBeat(heartRate)
+        self.display.updatePlots(speed, strokeRate, heartRate)
 
         if self.state.isPaused():
-            countDown = self.state.maxPause - self.state.hasBeenFor()
+            countDown = int(self.state.maxPause - self.state.hasBeenFor())
             if countDown >= 0:
                 self.display.updateStatus("PAUSED {:d}:{:02d}...".format(int(countDown/60), countDown % 60), 'red')
 
-        self.display.update()
-        return rc
+    #
+    # Log the data for a completed stroke (from a PM5.Sample), and its force curve, for post-workout analysis
+    #
+    def updateStroke(self, sample):
+        if self.logbook is not None and self.state.isRunning():
+            self.logbook.appendStroke(sample)
+
+    def updateForceCurve(self, forces):
+        if self.logbook is not None and self.state.isRunning():
+            self.logbook.appendForceCurve(forces)
+
+    #
+    # Called from the notification handlers: only close the log here.
+    # It is indexed and analyzed after the workout, off the event loop.
+    #
+    def closeLog(self):
+        if self.logbook is None:
+            return
+        self.logbook.close()
+        # A session aborted before any sample was received is not worth keeping
+        if self.logbook.count == 0:
+            shutil.rmtree(self.logbook.path, ignore_errors=True)
+        else:
+            self.closedLogs.append(self.logbook.path)
+        self.logbook = None
+
+    def takeClosedLogs(self):
+        paths = self.closedLogs
+        self.closedLogs = []
+        return paths
+
+    def endWorkout(self):
+        if not self.ended:
+            self.ended = True
+            self.commands.put_nowait(None)
 
     def abort(self):
-        self.newPhase.set_result(None)
+        self.endWorkout()
         self.state.abort()
+        self.closeLog()
+
+
+#
+# Add a completed session to the history index and analyze it. Returns its summary, or None.
+# Slow (SQLite, and the first NumPy import): run it in a worker thread.
+#
+def processLog(path):
+    # Incrementally update the history index with the completed session
+    try:
+        history = History.History(User.historyPath)
+        history.add(path)
+        history.close()
+    except Exception as err:
+        log.warning("Cannot index workout: %s", err)
+
+    # NumPy is only needed once the workout is done: import it here to keep the start-up fast
+    try:
+        import Analytics
+        return Analytics.analyze(path)
+    except Exception as err:
+        log.warning("Cannot analyze workout: %s", err)
+    return None
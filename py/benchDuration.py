@@ -0,0 +1,74 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# Throughput of the AMAZON.DURATION parser, against the original character walker
+#
+#    python3 benchDuration.py [iterations]
+#
+
+import logging
+import sys
+import timeit
+
+logging.getLogger().addHandler(logging.NullHandler())
+
+from lambda_function import ISO8601_to_secs
+
+
+#
+# The original parser, in minutes
+#
+def legacyISO8601_to_mins(duration):
+    mins = 0
+    val = 0
+    for char in duration:
+        if char.isdigit():
+            val = (val * 10) + int(char)
+            continue
+        if char == 'H':
+            mins += val * 60
+            val = 0
+            continue
+        if char == 'M':
+            mins += val;
+        val = 0;
+
+    return mins
+
+
+iterations = 100000
+if len(sys.argv) > 1:
+    iterations = int(sys.argv[1])
+
+durations = ["PT30M", "PT1H", "PT1H30M", "PT45M", "PT20M", "PT1H5M10S"]
+
+def legacy():
+    for d in durations:
+        legacyISO8601_to_mins(d)
+
+def uncached():
+    for d in durations:
+        ISO8601_to_secs.__wrapped__(d)
+
+def cached():
+    for d in durations:
+        ISO8601_to_secs(d)
+
+for name, fn in (("legacy", legacy), ("regex", uncached), ("regex, cached", cached)):
+    secs = min(timeit.repeat(fn, number=iterations // len(durations), repeat=3))
+    print("{:14s} {:8.0f} ns/duration   {:10.0f} durations/s".format(name, secs / iterations * 1e9, iterations / secs))
+print(ISO8601_to_secs.cache_info())
@@ -0,0 +1,87 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# Benchmark the workout history queries against a synthetic 5-year history
+#
+#    python3 benchHistory.py [years] [workouts per week]
+#
+
+import os
+import random
+import sys
+import tempfile
+import time
+import timeit
+
+import History
+
+
+years   = 5
+perWeek = 5
+if len(sys.argv) > 1:
+    years = int(sys.argv[1])
+if len(sys.argv) > 2:
+    perWeek = int(sys.argv[2])
+
+random.seed(1)
+
+dbPath  = os.path.join(tempfile.mkdtemp(), "history.db")
+history = History.History(dbPath)
+
+#
+# Build the synthetic history
+#
+workouts = [("Normal", 30, None), ("Easy", 20, None), ("Intense", None, 2000),
+            ("Normal", None, 5000), ("Interval", 40, None)]
+
+nSessions = years * 52 * perWeek
+first = time.time() - years * 365 * 24 * 3600
+start = time.perf_counter()
+for i in range(nSessions):
+    intensity, duration, distance = random.choice(workouts)
+    pace = random.uniform(105, 150)
+    if distance is None:
+        totalTime     = duration * 60
+        totalDistance = totalTime * 500 / pace
+    else:
+        totalDistance = distance
+        totalTime     = distance * pace / 500
+    splits = [pace + random.uniform(-5, 5) for s in range(int(totalDistance // 500))]
+    bests  = {d: d * (pace - random.uniform(0, 4)) / 500 for d in History.bestDistances if d <= totalDistance}
+
+    history.insert("synthetic/{:05d}".format(i),
+                   {'start': first + i * 7 * 24 * 3600 / perWeek,
+                    'intensity': intensity, 'duration': duration, 'distance': distance},
+                   {'totalTime': totalTime, 'totalDistance': totalDistance, 'avgPace': pace,
+                    'avgStrokeRate': random.uniform(18, 30), 'avgHeartRate': random.uniform(110, 160),
+                    'maxHeartRate': random.randint(150, 190)},
+                   splits, bests)
+print("Indexed {} sessions in {:.2f} secs ({:.2f} ms/session)".format(nSessions, time.perf_counter() - start,
+                                                                          (time.perf_counter() - start) * 1000 / nSessions))
+
+queries = [("Best 2k",                      lambda: history.best(2000)),
+           ("Weekly meters (last year)",    lambda: history.weeklyMeters(52)),
+           ("Avg pace, 30 min Normal",      lambda: history.averagePace("Normal", 30, None)),
+           ("Avg pace, 5000m Normal",       lambda: history.averagePace("Normal", None, 5000)),
+           ("Best 500m split",              lambda: history.bestSplit())]
+
+for name, query in queries:
+    n = 200
+    secs = min(timeit.repeat(query, number=n, repeat=3))
+    print("{:30s} {:8.3f} ms/query   {}".format(name, secs * 1000 / n, str(query())[:50]))
+
+history.close()
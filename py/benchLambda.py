@@ -0,0 +1,86 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# Benchmark the cold and warm latency of the Alexa skill handler, against the dummy boto3 module
+#
+#    python3 benchLambda.py [client creation time] [shadow update time] [publish time]     (simulated, in ms)
+#
+
+import logging
+import statistics
+import sys
+import time
+
+import boto3
+
+
+# Simulated latencies, in ms: a shadow update waits for the service to apply it, a publish does not
+boto3.requestTime = 8 / 1000
+boto3.publishTime = 4 / 1000
+if len(sys.argv) > 1:
+    boto3.clientTime = float(sys.argv[1]) / 1000
+if len(sys.argv) > 2:
+    boto3.requestTime = float(sys.argv[2]) / 1000
+if len(sys.argv) > 3:
+    boto3.publishTime = float(sys.argv[3]) / 1000
+
+# Lambda sends the log messages to CloudWatch: keep them from being printed here
+logging.getLogger().addHandler(logging.NullHandler())
+
+applicationId = "amzn1.ask.skill.4254825f-0ea2-482a-a593-0abd200fc84e"
+
+def event(intent, slots={}):
+    return {'session': {'application': {'applicationId': applicationId}, 'attributes': {}},
+            'context': {},
+            'request': {'type': "IntentRequest",
+                        'intent': {'name': intent, 'slots': slots}}}
+
+events = [event("JustRow"),
+          event("WorkoutTime", {'Intensity': {'name': "Intensity", 'value': "easy"},
+                                'TotalTime': {'name': "TotalTime", 'value': "PT30M"}}),
+          event("StopWorkout")]
+
+
+def invoke(handler, e):
+    start = time.perf_counter()
+    handler(e, None)
+    return time.perf_counter() - start
+
+
+#
+# Cold: a fresh container imports the function, then handles its first request
+#
+cold = []
+for i in range(20):
+    sys.modules.pop('lambda_function', None)
+    start = time.perf_counter()
+    import lambda_function
+    lambda_function.lambda_handler(events[0], None)
+    cold.append(time.perf_counter() - start)
+
+#
+# Warm: the same container handles subsequent requests
+#
+for fireAndForget in (True, False):
+    lambda_function.fireAndForget = fireAndForget
+    warm = [invoke(lambda_function.lambda_handler, events[i % len(events)]) for i in range(600)]
+    print("Warm, {:16s} p50 {:8.3f} ms   p99 {:8.3f} ms".format("fire-and-forget:" if fireAndForget else "shadow update:",
+                                                               statistics.median(warm) * 1000,
+                                                               statistics.quantiles(warm, n=100)[98] * 1000))
+
+print("Cold:                  p50 {:8.3f} ms   max {:8.3f} ms".format(statistics.median(cold) * 1000, max(cold) * 1000))
+print("boto3 clients created: {} for {} containers".format(len(boto3.clients), len(cold)))
@@ -0,0 +1,89 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# Micro-benchmark of the per-notification cost of decoding the PM-5 rowing status
+#
+#    python3 benchPM5.py [iterations]
+#
+
+import struct
+import sys
+import timeit
+
+import PM5
+from PM5 import PM5UUID
+
+
+#
+# The original dict-based decoders, minus the print()
+#
+stats = {}
+
+def legacyRowingStatus(val):
+    vals = struct.unpack('<HBHBBBBBBHBHBBB', val)
+
+    stats['ElapsedTime']   = (vals[1] << 16) + vals[0]
+    stats['Distance']      = (vals[3] << 16) + vals[2]
+    stats['WorkoutType']   = vals[4]
+    stats['IntervalType']  = vals[5]
+    stats['WorkoutState']  = vals[6]
+    stats['RowingState']   = vals[7]
+    stats['StrokeState']   = vals[8]
+    stats['TotalDistance'] = (vals[10] << 16) + vals[9]
+    stats['Duration']      = (vals[12] << 16) + vals[11]
+    stats['DurationType']  = vals[13]
+    stats['DragFactor']    = vals[14]
+
+
+def legacyRowingStatus1(val):
+    vals = struct.unpack('<HBHBBHHHBHB', val)
+
+    stats['ElapsedTime'] = (vals[1] << 16) + vals[0]
+    stats['Speed']       = vals[2]
+    stats['StrokeRate']  = vals[3]
+    stats['HeartBPM']    = vals[4]
+    stats['Pace']        = vals[5]
+    stats['AvgPace']     = vals[6]
+    stats['RestDist']    = vals[7]
+    stats['RestTime']    = (vals[9] << 16) + vals[8]
+
+
+iterations = 200000
+if len(sys.argv) > 1:
+    iterations = int(sys.argv[1])
+
+sample = PM5.Sample()
+sample.ElapsedTime = 123456
+sample.Distance    = 98765
+sample.Speed       = 3456
+sample.StrokeRate  = 24
+sample.HeartBPM    = 142
+sample.Pace        = 14467
+
+rowStatus  = PM5.decoders[PM5UUID['RowStatus']]
+rowStatus1 = PM5.decoders[PM5UUID['RowStatus1']]
+val  = bytearray(rowStatus.encode(sample))
+val1 = bytearray(rowStatus1.encode(sample))
+
+cases = [("RowStatus  legacy",  lambda: legacyRowingStatus(val)),
+         ("RowStatus  decoder", lambda: rowStatus.decode(val, sample)),
+         ("RowStatus1 legacy",  lambda: legacyRowingStatus1(val1)),
+         ("RowStatus1 decoder", lambda: rowStatus1.decode(val1, sample))]
+
+for name, fct in cases:
+    secs = min(timeit.repeat(fct, number=iterations, repeat=5))
+    print("{:20s} {:8.3f} us/notification".format(name, secs * 1e6 / iterations))
@@ -0,0 +1,93 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# Measure the cost of the imports done by main.py before the display is shown,
+# using 'python3 -X importtime'
+#
+#    python3 benchStartup.py [max msecs]
+#
+# Exits with an error if the total import time exceeds the optional limit,
+# so startup regressions are visible.
+#
+
+import ast
+import os
+import subprocess
+import sys
+
+
+#
+# The modules imported by main.py at startup: its top-level imports
+# (imports inside functions are deferred by design)
+#
+def startupImports(path):
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            if name not in modules:
+                modules.append(name)
+    return modules
+
+# Modules that must NOT be imported at startup
+deferredModules = ["matplotlib", "numpy", "bleak", "AWSIoTPythonSDK"]
+
+
+here = os.path.dirname(os.path.abspath(__file__))
+startupModules = startupImports(os.path.join(here, "main.py"))
+proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + ", ".join(startupModules)],
+                      cwd=here, stderr=subprocess.PIPE, universal_newlines=True)
+if proc.returncode != 0:
+    print(proc.stderr)
+    exit(1)
+
+# Lines are "import time: self [us] | cumulative | imported package"
+imports = []
+for line in proc.stderr.splitlines():
+    if not line.startswith("import time:"):
+        continue
+    fields = line[len("import time:"):].split("|")
+    if not fields[0].strip().isdigit():
+        continue
+    imports.append((int(fields[1]), int(fields[0]), fields[2].rstrip()))
+
+# Top-level imports have no indentation
+total = sum(cumulative for cumulative, own, name in imports if not name.startswith("  "))
+
+print("{:>10s} {:>10s}  {}".format("cumul(us)", "self(us)", "module"))
+for cumulative, own, name in sorted(imports, reverse=True)[:15]:
+    print("{:10d} {:10d}  {}".format(cumulative, own, name))
+print("Total startup import time: {:.1f} ms".format(total / 1000))
+
+rc = 0
+for cumulative, own, name in imports:
+    if name.strip().split(".")[0] in deferredModules:
+        print("ERROR: " + name.strip() + " is imported at startup")
+        rc = 1
+
+if len(sys.argv) > 1 and total / 1000 > float(sys.argv[1]):
+    print("ERROR: startup import time exceeds {} ms".format(sys.argv[1]))
+    rc = 1
+
+exit(rc)
@@ -1 +1,39 @@
 # Dummy boto3 module
+#
+# Stands in for boto3 when running lambda_function.py locally (see benchLambda.py).
+# Calls are recorded, and take the simulated time below, in seconds.
+#
+
+import io
+import time
+
+clientTime  = 0
+requestTime = 0     # update_thing_shadow (the service applies the update before responding)
+publishTime = 0     # publish
+
+clients = []
+
+
+class Client:
+
+    def __init__(self, service, region_name=None, config=None):
+        self.service = service
+        self.config  = config
+        self.calls   = []
+
+    def update_thing_shadow(self, thingName, payload):
+        self.calls.append(('update_thing_shadow', thingName, payload))
+        time.sleep(requestTime)
+        return {'payload': io.BytesIO(b'{"state": {}}')}
+
+    def publish(self, topic, qos=0, payload=b''):
+        self.calls.append(('publish', topic, payload))
+        time.sleep(publishTime)
+        return {}
+
+
+def client(service, region_name=None, config=None):
+    time.sleep(clientTime)
+    c = Client(service, region_name, config)
+    clients.append(c)
+    return c
@@ -1,5 +1,7 @@
+import functools
 import json
 import logging
+import os
 
 import boto3
 
@@ -10,24 +12,57 @@ logger.setLevel(logging.DEBUG)
 
 
 #
-# Translate AMAZON.DURATION ISO-8601 values into minutes
+# The IoT data client is expensive to create: it is created once per Lambda container,
+# on first use, and reused by all subsequent invocations.
+# Timeouts are kept short since Alexa gives up on the skill after 8 seconds.
 #
-def ISO8601_to_mins(duration):
-    mins = 0
-    val = 0
-    for char in duration:
-        if char.isdigit():
-            val = (val * 10) + int(char)
-            continue
-        if char == 'H':
-            mins += val * 60
-            val = 0
-            continue
-        if char == 'M':
-            mins += val;
-        val = 0;
-        
-    return mins
+shadowClient = None
+
+def getShadowClient():
+    global shadowClient
+
+    if shadowClient is None:
+        try:
+            from botocore.config import Config
+            config = Config(connect_timeout=2, read_timeout=2, max_pool_connections=2,
+                            tcp_keepalive=True, retries={'max_attempts': 2, 'mode': 'standard'})
+        except ImportError:
+            config = None
+        shadowClient = boto3.client('iot-data', 'us-east-1', config=config)
+    return shadowClient
+
+
+#
+# Publish the desired state on the shadow update topic instead of waiting for the updated shadow document.
+# The publish is still a synchronous HTTPS request, so it only saves the shadow service's processing time;
+# an update rejected by the shadow service is then silently lost while Alexa says the workout is starting.
+# It also requires the iot:Publish permission on the shadow update topic in the function's IAM role.
+#
+fireAndForget = False
+
+
+#
+# Translate AMAZON.DURATION ISO-8601 values (PnYnMnWnDTnHnMnS, each component optional,
+# with an optional decimal fraction) into seconds. Returns None if not a valid duration.
+# Years and months are taken as 365 and 30 days.
+# The few durations people actually say are cached.
+#
+durationRegex = re.compile(r'P(?=\d|T\d)'
+                           r'(?:(\d+(?:[.,]\d+)?)Y)?(?:(\d+(?:[.,]\d+)?)M)?(?:(\d+(?:[.,]\d+)?)W)?(?:(\d+(?:[.,]\d+)?)D)?'
+                           r'(?:T(?=\d)(?:(\d+(?:[.,]\d+)?)H)?(?:(\d+(?:[.,]\d+)?)M)?(?:(\d+(?:[.,]\d+)?)S)?)?')
+
+durationUnits = (365 * 86400, 30 * 86400, 7 * 86400, 86400, 3600, 60, 1)
+
+@functools.lru_cache(maxsize=64)
+def ISO8601_to_secs(duration):
+    match = durationRegex.fullmatch(duration)
+    if match is None:
+        return None
+    secs = 0
+    for value, unit in zip(match.groups(), durationUnits):
+        if value is not None:
+            secs += float(value.replace(',', '.')) * unit
+    return secs
 
 
 #                                                                                                                                                                                        
@@ -69,6 +104,30 @@ class Response:
                                     "slotToElicit": slot} ]
 
 
+#
+# Responses that do not depend on the request are built once per container, and shared.
+# They must never be modified.
+#
+def staticResponse(title, say, keepSessionOpen=False):
+    response = Response(title, say)
+    if keepSessionOpen:
+        response.keepSessionOpen()
+    return response
+
+staticResponses = {'launch':    staticResponse("Workout", "What workout would you like to start?", True),
+                   'help':      staticResponse("Help",
+                                               "I can connect and monitor a workout on your rowing machine. " +
+                                               "Just ask me to start an easy, normal, or intense 30 minutes or 3000 meters workout. " +
+                                               "You can also ask me to pause, resume, or stop a workout in progress.", True),
+                   'free':      staticResponse("Workout", "Starting a free workout."),
+                   'scheduled': staticResponse("Workout", "Starting today's scheduled workout."),
+                   'pause':     staticResponse("Workout", "Pausing your work-out."),
+                   'stop':      staticResponse("Workout", "Stopping your workout."),
+                   'goodbye':   staticResponse(None, "Goodbye."),
+                   'unknown':   staticResponse("Sorry", "Sorry. Your rower doesn't know how to do that."),
+                   'error':     staticResponse("Sorry", "Sorry. Something went wrong")}
+
+
 class EventHandler:
 
     def __init__(self, context, state):
@@ -77,7 +136,6 @@ class EventHandler:
         self.response       = None
 
         self.topic          = "$aws/things/MyRower/shadow/update"
-        self.shadowClient   = boto3.client('iot-data', 'us-east-1')
 
 
     def validateIntensity(self, intensity):
@@ -102,20 +160,24 @@ class EventHandler:
 
     def updateShadow(self, new_value_dict):
         """
-        Updates IoT shadow's "desired" state with values from new_value_dict. Logs
-        current "desired" state after update.
+        Updates IoT shadow's "desired" state with values from new_value_dict.
+
+        Unset (None) values are sent as null, to delete them from the desired state:
+        the Pi may not have cleared a previous request yet.
+
+        In fire-and-forget mode, the update is published on the shadow update topic:
+        the shadow service applies it asynchronously and the response is empty.
+        Otherwise, the updated shadow document returned by the service is discarded unread.
 
         Args:
         new_value_dict: Python dict of values to update in shadow
         """
-        payload = {
-            "state": {
-                "desired" : new_value_dict
-            }
-        }
-        response = self.shadowClient.update_thing_shadow(thingName = "MyRower",
-                                                         payload   = json.dumps(payload))
-        res_payload = json.loads(response['payload'].read().decode('utf-8'))
+        payload = json.dumps({"state": {"desired" : new_value_dict}})
+        if fireAndForget:
+            getShadowClient().publish(topic = self.topic, qos = 0, payload = payload)
+        else:
+            response = getShadowClient().update_thing_shadow(thingName = "MyRower", payload = payload)
+            response['payload'].close()
         
         
     def StartWorkoutTime(self, slots):
@@ -135,7 +197,14 @@ class EventHandler:
             self.response.keepSessionOpen()
             return True
 
-        duration = ISO8601_to_mins(self.slots['TotalTime']['value'])
+        secs = ISO8601_to_secs(self.slots['TotalTime']['value'])
+        if secs is None:
+            self.response = Response("Duration",
+                                    "Sorry, but I do not understand how long of a workout your want. " +
+                                    "What workout or race would you like to start?")
+            self.response.keepSessionOpen()
+            return True
+        duration = int(round(secs / 60))
 
         # If the duration is too short, ask again
         if duration < 20:
@@ -186,32 +255,37 @@ class EventHandler:
 
     def StartWorkoutFree(self):
         self.updateShadow({'intensity': "Normal", 'duration': None, 'distance': None})
-        self.response = Response("Workout", "Starting a free workout.")
+        self.response = staticResponses['free']
         return True
 
     
     def StartWorkoutScheduled(self):
         self.updateShadow({'intensity': "Scheduled", 'duration': None, 'distance': None})
-        self.response = Response("Workout", "Starting today's scheduled workout.")
+        self.response = staticResponses['scheduled']
         return True
 
     
     def PauseWorkout(self):
         self.updateShadow({'intensity': "Pause", 'duration': None, 'distance': None})
-        self.response = Response("Workout", "Pausing your work-out.")
+        self.response = staticResponses['pause']
         return True
 
     
     def StopWorkout(self):
         self.updateShadow({'intensity': "Abort", 'duration': None, 'distance': None})
-        self.response = Response("Workout", "Stopping your workout.")
+        self.response = staticResponses['stop']
+        return True
+
+
+    # Leave the skill
+    def endSession(self):
+        self.response = staticResponses['goodbye']
         return True
 
     
     # When the skill gets launched
     def onLaunch(self):
-        self.response = Response("Workout", "What workout would you like to start?")
-        self.response.keepSessionOpen()
+        self.response = staticResponses['launch']
         return True
 
 
@@ -224,43 +298,15 @@ class EventHandler:
         if 'slots' in intent:
             self.slots = intent['slots']
 
-        if intent['name'] == "AMAZON.HelpIntent":
-            return self.help("")
-
-        if intent['name'] == "WorkoutTime":
-            return self.StartWorkoutTime(self.slots)
-            
-        if intent['name'] == "WorkoutDistanceMeters":
-            return self.StartWorkoutDistance(self.slots, 1)
-            
-        if intent['name'] == "WorkoutDistanceKilometers":
-            return self.StartWorkoutDistance(self.slots, 1000)
-            
-        if intent['name'] == "JustRow":
-            return self.StartWorkoutFree()
-            
-        if intent['name'] == "ScheduledWorkout":
-            return self.StartWorkoutScheduled()
-            
-        if intent['name'] == "PauseWorkout":
-            return self.PauseWorkout()
-            
-        if intent['name'] == "ResumeWorkout":
-            return self.ResumeWorkout()
-            
-        if intent['name'] == "StopWorkout":
-            return self.StopWorkout()
-            
-        self.response = Response("Sorry", "Sorry. Your rower doesn't know how to do that.")
-        return False;
+        handler = intentRouter.get(intent['name'])
+        if handler is None:
+            self.response = staticResponses['unknown']
+            return False
+        return handler(self, self.slots)
 
 
-    def help(self, prefix):
-        self.response = Response("Help", prefix + \
-                                "I can connect and monitor a workout on your rowing machine. " + \
-                                 "Just ask me to start an easy, normal, or intense 30 minutes or 3000 meters workout. " +
-                                 "You can also ask me to pause, resume, or stop a workout in progress.")
-        self.response.keepSessionOpen()
+    def help(self):
+        self.response = staticResponses['help']
         return True
 
 
@@ -287,13 +333,58 @@ class EventHandler:
             if isOK:
                 return None
 
-            self.response = Response("Sorry", "Sorry. Something went wrong")
+            self.response = staticResponses['error']
 
         return {'version': '1.0',
                 'sessionAttributes': self.state,
                 'response': self.response.rsp}
 
 
+#
+# The handler for each intent
+#
+intentHandlers = {'AMAZON.HelpIntent':         lambda handler, slots: handler.help(),
+                  'AMAZON.CancelIntent':       lambda handler, slots: handler.endSession(),
+                  'AMAZON.StopIntent':         lambda handler, slots: handler.endSession(),
+                  'AMAZON.NavigateHomeIntent': lambda handler, slots: handler.endSession(),
+                  'WorkoutTime':               lambda handler, slots: handler.StartWorkoutTime(slots),
+                  'WorkoutDistanceMeters':     lambda handler, slots: handler.StartWorkoutDistance(slots, 1),
+                  'WorkoutDistanceKilometers': lambda handler, slots: handler.StartWorkoutDistance(slots, 1000),
+                  'JustRow':                   lambda handler, slots: handler.StartWorkoutFree(),
+                  'ScheduledWorkout':          lambda handler, slots: handler.StartWorkoutScheduled(),
+                  'PauseWorkout':              lambda handler, slots: handler.PauseWorkout(),
+                  'StopWorkout':               lambda handler, slots: handler.StopWorkout()}
+
+
+#
+# The interaction model is deployed with the function, or is in the parent directory of the source tree
+#
+def loadInteractionModel():
+    here = os.path.dirname(os.path.abspath(__file__))
+    for path in (os.path.join(here, "alexa.json"), os.path.join(here, "..", "alexa.json")):
+        if os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+    raise RuntimeError("Cannot find the alexa.json interaction model")
+
+
+#
+# Build the intent router from the intents in the interaction model.
+# Fails when the function is loaded if an intent has no handler.
+#
+def buildIntentRouter(model):
+    intents = [intent['name'] for intent in model['interactionModel']['languageModel']['intents']]
+    missing = [name for name in intents if name not in intentHandlers]
+    if missing:
+        raise RuntimeError("No handler for intent(s) " + ", ".join(missing))
+    for name in intentHandlers:
+        if name not in intents:
+            logging.warning("Handler for intent " + name + " is not in the interaction model")
+    return {name: intentHandlers[name] for name in intents}
+
+intentRouter = buildIntentRouter(loadInteractionModel())
+
+
 def lambda_handler(event, context):
     logging.info("event.session.application.applicationId=" +
                  event['session']['application']['applicationId'])
@@ -0,0 +1,191 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# Offline load test of the Alexa skill handler, against the dummy boto3 module
+#
+# Request envelopes are generated from the sample utterances and slot types in alexa.json,
+# then replayed concurrently against lambda_function.lambda_handler.
+# Reports the throughput, the p50/p99 latency, and the memory allocated per invocation.
+#
+#    python3 loadLambda.py [requests] [threads] [request time]     (simulated, in ms)
+#
+
+import concurrent.futures
+import json
+import logging
+import os
+import random
+import re
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+
+import boto3
+
+
+requests = 10000
+threads  = 8
+if len(sys.argv) > 1:
+    requests = int(sys.argv[1])
+if len(sys.argv) > 2:
+    threads = int(sys.argv[2])
+if len(sys.argv) > 3:
+    boto3.requestTime = float(sys.argv[3]) / 1000
+
+# Lambda sends the log messages to CloudWatch: keep them from being printed here
+logging.getLogger().addHandler(logging.NullHandler())
+
+import lambda_function
+
+
+applicationId = "amzn1.ask.skill.4254825f-0ea2-482a-a593-0abd200fc84e"
+
+#
+# Spoken values of the built-in slot types, as Alexa resolves them
+#
+builtinValues = {'AMAZON.DURATION': ["PT30M", "PT20M", "PT45M", "PT1H", "PT1H30M", "PT2H", "PT10M",
+                                     "PT90S", "PT25M30S", "PT1H5M10S", "P1D", "PT0.5H"],
+                 'AMAZON.NUMBER':   ["1", "2", "5", "10", "21", "500", "1000", "2000", "5000", "10000"]}
+
+
+#
+# Spoken values of each slot type: the built-in ones, and the values and synonyms of the custom ones
+#
+def slotValues(model):
+    values = dict(builtinValues)
+    for slotType in model['types']:
+        values[slotType['name']] = [spoken for value in slotType['values']
+                                           for spoken in [value['name']['value']] + value['name'].get('synonyms', [])]
+    return values
+
+
+def envelope(request, new=True):
+    return {'version': "1.0",
+            'session': {'new': new,
+                        'sessionId': "amzn1.echo-api.session." + str(uuid.uuid4()),
+                        'application': {'applicationId': applicationId},
+                        'attributes': {},
+                        'user': {'userId': "amzn1.ask.account.LOADTEST"}},
+            'context': {'System': {'application': {'applicationId': applicationId},
+                                   'device': {'deviceId': "amzn1.ask.device.LOADTEST"}}},
+            'request': dict(request, requestId="amzn1.echo-api.request." + str(uuid.uuid4()),
+                            timestamp=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), locale="en-US")}
+
+
+#
+# Generate 'n' request envelopes, in random order, each with the utterance it stands for.
+# Each sample utterance of each intent is filled with random slot values. A slot is sometimes left
+# unfilled, as when Alexa does not recognize what was said.
+#
+def generate(model, n, rnd):
+    values  = slotValues(model)
+    intents = model['intents']
+
+    events = []
+    while len(events) < n:
+        choice = rnd.random()
+        if choice < 0.05:
+            events.append(("(launch)", envelope({'type': "LaunchRequest"})))
+            continue
+        if choice < 0.10:
+            events.append(("(end)", envelope({'type': "SessionEndedRequest", 'reason': "USER_INITIATED"}, new=False)))
+            continue
+
+        intent    = rnd.choice(intents)
+        samples   = intent.get('samples') or [intent['name']]
+        utterance = rnd.choice(samples)
+        slots     = {}
+        for slot in intent.get('slots', []):
+            slots[slot['name']] = {'name': slot['name'], 'confirmationStatus': "NONE"}
+            if '{' + slot['name'] + '}' in utterance and rnd.random() < 0.95:
+                value = rnd.choice(values[slot['type']])
+                slots[slot['name']]['value'] = value
+                utterance = utterance.replace('{' + slot['name'] + '}', value)
+        utterance = re.sub(r'{(\w+)}', "", utterance)
+        events.append((utterance, envelope({'type': "IntentRequest",
+                                            'intent': {'name': intent['name'], 'confirmationStatus': "NONE",
+                                                       'slots': slots}})))
+    return events
+
+
+#
+# A response must speak something, unless the session has ended
+#
+def check(event, response):
+    if event['request']['type'] == "SessionEndedRequest":
+        return True
+    return response is not None and 'outputSpeech' in response['response']
+
+
+def invoke(utterance, event):
+    start = time.perf_counter()
+    try:
+        response = lambda_function.lambda_handler(event, None)
+        ok = check(event, response)
+    except Exception as e:
+        ok = False
+        print("Error: \"" + utterance + "\": " + repr(e))
+    return time.perf_counter() - start, ok
+
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "alexa.json")) as f:
+    model = json.load(f)['interactionModel']['languageModel']
+
+events = generate(model, requests, random.Random(1))
+
+# Warm the container up
+for utterance, event in events[:100]:
+    invoke(utterance, event)
+
+#
+# Memory allocated per invocation, one at a time since tracemalloc cannot tell the threads apart
+#
+tracemalloc.start()
+peaks    = []
+retained = 0
+for utterance, event in events[:1000]:
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    invoke(utterance, event)
+    current, peak = tracemalloc.get_traced_memory()
+    peaks.append(peak - before)
+    retained += current - before
+tracemalloc.stop()
+
+#
+# Concurrent replay
+#
+start = time.perf_counter()
+with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+    results = list(pool.map(lambda e: invoke(*e), events))
+elapsed = time.perf_counter() - start
+
+latencies = [latency for latency, ok in results]
+failed    = sum([1 for latency, ok in results if not ok])
+
+print("Requests:    {} on {} threads, {} failed".format(len(results), threads, failed))
+print("Throughput:  {:10.0f} requests/s".format(len(results) / elapsed))
+print("Latency:     p50 {:8.3f} ms   p99 {:8.3f} ms".format(statistics.median(latencies) * 1000,
+                                                        statistics.quantiles(latencies, n=100)[98] * 1000))
+print("Memory:      {:8.1f} kB peak per invocation (max {:.1f} kB), {:.1f} B retained".format(statistics.mean(peaks) / 1024,
+                                                                                              max(peaks) / 1024,
+                                                                                              retained / len(peaks)))
+print("Shadow updates: {}".format(sum([len(client.calls) for client in boto3.clients])))
+
+sys.exit(1 if failed else 0)
@@ -22,12 +22,21 @@ import os
 import platform
 import struct
 import sys
+import threading
 import time
 import uuid
 
 import User
+import Latency
+import Logger
+import CSAFE
 import Workout
 import Display
+import PM5
+import Replay
+import Connection
+import Shadow
+import Telemetry
 
 import aiotkinter
 
@@ -37,8 +46,8 @@ import aiotkinter
 #
 # AWS IoT
 #
-from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTShadowClient
 
+log = Logger.get("AWS")
 
 thingName = "MyRower"
 clientId  = "pROWess"
@@ -55,10 +64,38 @@ class MyMQTTClient:
     """
     Client to maintain a connection between the Raspberry Pi and the IoT Shadow.
     """
-    def __init__(self, display, workout):
-        self.display = display
-        self.workout = workout
-        
+    def __init__(self, workout, loop, telemetry=None):
+        self.workout   = workout
+        self.telemetry = telemetry
+
+        # The shadow callbacks run in the MQTT client thread:
+        # the deltas are handed over to the bridge task, which runs in the event loop
+        self.loop   = loop
+        self.deltas = asyncio.Queue()
+
+        self.shadowState   = {'intensity': "Idle", 'duration': None, 'distance': None}
+        self.shadowHandler = None
+
+        # Version of the last delta applied: older or duplicate deltas are dropped
+        self.version = None
+
+        # Shadow updates are sent by a background worker so they never block the UI or the MQTT thread
+        self.reporter = Shadow.ShadowReporter()
+
+        # Connecting to AWS IoT takes a while: do it in the background so the display is available right away
+        threading.Thread(target=self.connect, daemon=True).start()
+
+
+    def postStatus(self, text, color='black'):
+        self.loop.call_soon_threadsafe(postStatus, text, color)
+
+
+    def connect(self):
+        self.postStatus("Connecting to AWS IoT...")
+
+        # The AWS IoT SDK is slow to import: only import it in the background thread
+        from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTShadowClient
+
         self.shadowClient = AWSIoTMQTTShadowClient(clientId)
 
         self.shadowClient.configureEndpoint(host, port)
@@ -67,31 +104,69 @@ class MyMQTTClient:
         self.shadowClient.configureConnectDisconnectTimeout(10)
         self.shadowClient.configureMQTTOperationTimeout(1)
 
-        self.display.updateStatus("Connecting to AWS IoT...")
-        self.display.update()
-        self.shadowClient.connect()
-
-        self.shadowHandler = self.shadowClient.createShadowHandlerWithName(thingName, True)
-        self.shadowHandler.shadowRegisterDeltaCallback(self.delta_callback)
+        # The network may not be up yet when started at boot: keep trying
+        backoff = 1
+        while True:
+            try:
+                self.shadowClient.connect()
+                break
+            except Exception as err:
+                log.error("Cannot connect to AWS IoT: %s", err)
+                self.postStatus("Cannot connect to AWS IoT, retrying in {} s".format(backoff), 'red')
+            time.sleep(backoff)
+            backoff = min(2 * backoff, 64)
+
+        shadowHandler = self.shadowClient.createShadowHandlerWithName(thingName, True)
+        self.loop.call_soon_threadsafe(self.resetVersion)
+        shadowHandler.shadowRegisterDeltaCallback(self.delta_callback)
+        self.shadowHandler = shadowHandler
+        self.reporter.setHandler(shadowHandler)
+        if self.telemetry is not None:
+            self.telemetry.setConnection(self.shadowClient.getMQTTConnection())
         self.gotoIdle()
 
-        self.display.updateStatus("")
-        self.display.update()
+        self.postStatus("Waiting for workout request...")
 
         
     def isIdle(self):
         return self.shadowState['intensity'] == "Idle"
 
 
+    # Going back to idle consumes the workout request: clear it so it does not start again
     def gotoIdle(self):
         self.shadowState = {'intensity': "Idle", 'duration': None, 'distance': None}
-        update = {'state': {'reported': self.shadowState, 'desired': self.shadowState}}
-        self.shadowHandler.shadowUpdate(json.dumps(update), None, 5)
+        self.reporter.report(self.shadowState, clearDesired=True)
+
+
+    # The shadow version restarts if the shadow is re-created
+    def resetVersion(self):
+        self.version = None
     
         
     def delta_callback(self, payload, token, arg):
-        delta = json.loads(payload)['state']
-        print("Delta: ", delta)
+        document = json.loads(payload)
+        log.debug("Delta: %s", payload)
+        self.loop.call_soon_threadsafe(self.deltas.put_nowait, (document.get('version'), document['state']))
+
+
+    #
+    # Apply the shadow deltas to the workout session, in the event loop
+    # and hand the requested workouts over to the rower task
+    #
+    async def bridge(self, workouts):
+        while True:
+            version, delta = await self.deltas.get()
+            self.applyDelta(delta, workouts, version)
+
+
+    def applyDelta(self, delta, workouts, version=None):
+        if version is not None:
+            if self.version is not None and version <= self.version:
+                log.debug("Dropping stale delta version %d (at %d)", version, self.version)
+                return
+            self.version = version
+
+        wasIdle = self.isIdle()
 
         if 'duration' in delta:
             self.shadowState['duration'] = delta['duration']
@@ -104,9 +179,10 @@ class MyMQTTClient:
         if self.shadowState['intensity'] == "Idle":
             self.gotoIdle()
             return
+        if wasIdle:
+            workouts.put_nowait(dict(self.shadowState))
         
-        update = {'state': {'reported': self.shadowState, 'desired': self.shadowState}}
-        self.shadowHandler.shadowUpdate(json.dumps(update), None, 5)
+        self.reporter.report(self.shadowState)
 
 
     def gotoNextState(self, nextState, delta):
@@ -135,11 +211,9 @@ class MyMQTTClient:
 #
 
 
-stats               = {}
+from PM5 import PM5UUID
 
-from bleak import discover
-from bleak import BleakClient
-from bleak import _logger as bleakLogger
+pm5Log = Logger.get("PM5")
 
 
 def now():
@@ -148,204 +222,332 @@ def now():
 
 workoutSession = None
 
+# Latest decoded values from all PM-5 notifications, updated in place
+sample = PM5.Sample()
 
-def decodeCSAFE(val):
-    rsp = unframeCSAFE(val)
-    if len(rsp) < 2:
-        return
-    
-    if rsp[1][0] == 0x94:
-        print("Serial No: " + "".join(chr(n) for n in rsp[1][1]))
-        return
-    
-    print("CSAFE RSP: ", rsp)
 
-    
-def decodeRowingStatus(charHandle, val):
-    global stats
-    
-    vals = struct.unpack('<HBHBBBBBBHBHBBB', val)
-    
-    stats['ElapsedTime']   = (vals[1] << 16) + vals[0]
-    stats['Distance']      = (vals[3] << 16) + vals[2]
-    stats['WorkoutType']   = vals[4]
-    stats['IntervalType']  = vals[5]
-    stats['WorkoutState']  = vals[6]
-    stats['RowingState']   = vals[7]
-    stats['StrokeState']   = vals[8]
-    stats['TotalDistance'] = (vals[10] << 16) + vals[9]
-    stats['Duration']      = (vals[12] << 16) + vals[11]
-    stats['DurationType']  = vals[13]
-    stats['DragFactor']    = vals[14]
-    
-    print(stats)
+rowStatus  = PM5.decoders[PM5UUID['RowStatus']]
+rowStatus1 = PM5.decoders[PM5UUID['RowStatus1']]
 
-    
-def decodeRowingStatus1(charHandle, val):
-    global stats
-    
-    vals = struct.unpack('<HBHBBHHHBHB', val)
-    
-    stats['ElapsedTime'] = (vals[1] << 16) + vals[0]
-    stats['Speed']       = vals[2]
-    stats['StrokeRate']  = vals[3]
-    stats['HeartBPM']    = vals[4]
-    stats['Pace']        = vals[5]
-    stats['AvgPace']     = vals[6]
-    stats['RestDist']    = vals[7]
-    stats['RestTime']    = (vals[9] << 16) + vals[8]
-    
-    print(stats)
-    
-
-lastElapsedTime = None
 def updateRowingStatus1(charHandle, val):
-    global workoutSession
-    global lastElapsedTime
-    
-    vals = struct.unpack('<HBHBBHHHBHB', val)
+    t0 = Latency.notified()
+    rowStatus1.decode(val, sample)
+    t1 = Latency.stage('decode', t0)
+
+    workoutSession.update(sample)
+    Latency.stage('session', t1)
+    Latency.stage('notify', t0)
+
+
+#
+# Keep the latest value of all other notifications in the sample record
+#
+def updateSample(decoder):
+    decode = decoder.decode
+    def handler(charHandle, val):
+        decode(val, sample)
+    return handler
 
-    elapsedTime = (vals[1] << 16) + vals[0]
-    speed       = vals[2]/1000
-    strokeRate  = vals[3]
-    heartBeat   = vals[4]
 
-    # When rowing stops, elasped time stops, but speed keeps the last value
-    if speed > 0 and elapsedTime == lastElapsedTime:
-        speed = 0
-    lastElapsedTime = elapsedTime
+# The additional stroke data arrives last for each stroke
+strokeData1 = PM5.decoders[PM5UUID['StrokeData1']]
+def updateStrokeData1(charHandle, val):
+    strokeData1.decode(val, sample)
+    workoutSession.updateStroke(sample)
+    if telemetry != None and workoutSession.state.isRunning():
+        telemetry.add(sample)
 
-    newPhase = workoutSession.update(speed, strokeRate, heartBeat)
-    if newPhase is None:
-        return;
 
-    #asyncio.create_task(newProgram(Phase))
+forceCurve = PM5.ForceCurve()
+def updateForceCurve(charHandle, val):
+    if forceCurve.add(val):
+        workoutSession.updateForceCurve(forceCurve.values())
 
 
-PM5UUID = {'getSerial'  : uuid.UUID('{ce060012-43e5-11e4-916c-0800200c9a66}'),
-           'sendCSAFE'  : uuid.UUID('{ce060021-43e5-11e4-916c-0800200c9a66}'),
-           'getCSAFE'   : uuid.UUID('{ce060022-43e5-11e4-916c-0800200c9a66}'),
-           'RowStatus'  : uuid.UUID('{ce060031-43e5-11e4-916c-0800200c9a66}'),
-           'RowStatus1' : uuid.UUID('{ce060032-43e5-11e4-916c-0800200c9a66}')}
+notificationHandlers = {'RowStatus':   updateSample(rowStatus),
+                        'RowStatus1':  updateRowingStatus1,
+                        'RowStatus2':  updateSample(PM5.decoders[PM5UUID['RowStatus2']]),
+                        'StrokeData':  updateSample(PM5.decoders[PM5UUID['StrokeData']]),
+                        'StrokeData1': updateStrokeData1,
+                        'SplitData':   updateSample(PM5.decoders[PM5UUID['SplitData']]),
+                        'SplitData1':  updateSample(PM5.decoders[PM5UUID['SplitData1']]),
+                        'ForceCurve':  updateForceCurve}
 
 
 #
-# Frame a CSAFE command string, adding start, checksum, and stop code
-# as well as escaping control bytes
+# Send the frames one at a time, waiting for the PM-5 to acknowledge each
 #
-def frameCSAFE(cmdBytes):
-    frame = [0xF1]
-    for b in cmdBytes:
-        if 0xF0 <= b and b <= 0xF3:
-            frame.append(0xF3)
-            frame.append(b - 0xF0)
-        else:
-            frame.append(b)
-    csum = 0x00
-    for i in range(1, len(frame)):
-        csum = csum ^ frame[i]
-    frame.append(csum)
-    frame.append(0xF2)
-    # print("CSAFE CMD: [" + ", ".join(hex(n) for n in frame) + "]")
-    return frame
-
-
-#
-# Parse a CSAFE response frame into an array of per-command response
-# First array element is the status, then all subsequent array element
-# are two-elements arrays with the command code and the response string for that command
-# e.g.
-#      [status,
-#       [cmdId, [rsp ... rsp ]],
-#       ...
-#       [cmdId, [rsp ... rsp ]]]
-#
-def unframeCSAFE(rspBytes):
-    print("CSAFE RSP: [" + ", ".join(hex(n) for n in rspBytes) + "]")
-    if rspBytes[0] != 0xF1:
-        return None
-    rsp = [rspBytes[1]]   # Status
-    i = 2;
-    while i < len(rspBytes)-2:
-        cmd = [rspBytes[i], []]
-        i = i + 1
-        rspLen = rspBytes[i]
-        i = i + 1
-        for j in range(rspLen):
-            if i >= len(rspBytes)-1:
-                return rsp
-            datum = rspBytes[i]
-            i = i + 1
-            if datum == 0xF3:
-                datum = rspBytes[i] + 0xF0
-                i = i + 1
-            cmd[1].append(datum)
-        rsp.append(cmd)
-
-    return rsp
+async def sendFrames(csafe, frames):
+    for frame in frames:
+        try:
+            await csafe.send(frame)
+        except asyncio.TimeoutError:
+            pm5Log.warning("No response from PM5 to CSAFE frame %s", frame.hex())
+
+
+async def programPhase(csafe, phase, maxWrite, frames=None):
+    if frames is None:
+        frames = CSAFE.phaseFrames(phase, maxWrite)
+    await sendFrames(csafe, frames)
+
 
+#
+# Build the frames for the phase that follows the current one
+# while the current one is rowed, so they are ready to be written as soon as the phase changes.
+# A free phase has nothing to build.
+#
+def pipelineNextPhase(maxWrite):
+    if len(workoutSession.phases) == 0 or Workout.isFree(workoutSession.phases[0]):
+        return None, None
+    phase = workoutSession.phases[0]
+    return phase, CSAFE.phaseFrames(phase, maxWrite)
+
+
+async def runRower(client):
+    commands = workoutSession.commands
+
+    # Largest write the connection allows
+    maxWrite = CSAFE.maxWriteSize
+    if getattr(client, 'mtu_size', None):
+        maxWrite = client.mtu_size - 3
+
+    # CSAFE responses are matched to their command
+    async def writeCSAFE(frame):
+        await client.write_gatt_char(PM5UUID['sendCSAFE'], frame, True)
+    csafe = CSAFE.Requester(writeCSAFE)
+    handler = csafe.notify
+    if recorder != None:
+        handler = recorder.wrap(PM5UUID['getCSAFE'], handler)
+    await client.start_notify(PM5UUID['getCSAFE'], handler)
+
+    try:
+        pm5Log.info("PM5 serial number: %s", await csafe.getSerial())
+        pm5Log.info("PM5 drag factor: %d", await csafe.getDragFactor())
+    except asyncio.TimeoutError:
+        pm5Log.warning("No CSAFE response from PM5")
+    except (KeyError, IndexError, ValueError) as err:
+        pm5Log.warning("Unexpected CSAFE response from PM5: %r", err)
+
+    # Go ready
+    await sendFrames(csafe, [CSAFE.goReadyFrame])
     
-async def findRower():
-    devices = await discover()
-    for device in devices:
-        if 'PM5' in device.name:
-            return device
-    return None
-
-
-async def programPhase(client, phase):
-    tsplit = phase['duration'] + phase['restTime'];
-    twork  = tsplit * phase['repeat'];
-    tsplit = int(tsplit * 0.01).to_bytes(4, 'little')
-    await client.write_gatt_char(PM5UUID['sendCSAFE'], frameCSAFE([0x87,                                                   # GOREADY
-                                                                   0x20, 0x03, 0x00, int(twork), (twork * 60) % 60,        # SETTWORK
-                                                                   0x1A, 0x07, 0x05, 0x05, 0x00, tsplit[0], tsplit[1], tsplit[2], tsplit[3],   # SETUSRCFG1 / PM_SET_SPLITDURATION
-                                                                   0x24, 0x02, 0x00, 0x00,                                 # SETPROGRAM
-                                                                   0x85]), True)                                           # GOINUSE
-async def runRower(rower):
-    async with BleakClient(rower) as client:
-        val = await client.read_gatt_char(PM5UUID['getSerial'])
-        print("Connected to PM5 Serial no " + val.decode())
-
-        newPhase = asyncio.get_running_loop().create_future();
-        
-        # Go ready
-        await client.write_gatt_char(PM5UUID['sendCSAFE'], frameCSAFE([0x87]), True)
-        
-        charHandlerByHandle = {}
+    # Trade-off notification rate vs CPU load according to the type of workout
+    await client.write_gatt_char(PM5UUID['SampleRate'], bytes([PM5.sampleRate(workoutSession.intensity)]), True)
+
+    charHandlerByHandle = {}
+    for name, handler in notificationHandlers.items():
+        if recorder != None:
+            handler = recorder.wrap(PM5UUID[name], handler)
+        charHandlerByHandle[client.services.get_characteristic(PM5UUID[name]).handle] = handler
+    
+    for charHandle in charHandlerByHandle.keys():
+        await client.start_notify(charHandle, charHandlerByHandle[charHandle])
         
-        # charHandlerByHandle[client.services.get_characteristic(PM5UUID['getCSAFE'  ]).handle] = decodeCSAFE
-        # charHandlerByHandle[client.services.get_characteristic(PM5UUID['RowStatus' ]).handle] = decodeRowingStatus
-        # charHandlerByHandle[client.services.get_characteristic(PM5UUID['RowStatus1']).handle] = decodeRowingStatus1
+    nextPhase = workoutSession.startNextPhase()
+    if nextPhase != None:
+        await programPhase(csafe, nextPhase, maxWrite)
+
+    postStatus("Start rowing!")
+
+    # The session queues the phase changes from the notification handlers:
+    # the notifications keep being processed while the PM-5 is reprogrammed
+    pending, pendingFrames = pipelineNextPhase(maxWrite)
+    while True:
+        phase = await commands.get()
+        if phase is None:
+            break
+
+        if phase is pending:
+            await programPhase(csafe, phase, maxWrite, pendingFrames)
+        else:
+            await programPhase(csafe, phase, maxWrite)
+        pending, pendingFrames = pipelineNextPhase(maxWrite)
 
-        charHandlerByHandle[client.services.get_characteristic(PM5UUID['RowStatus1']).handle] = updateRowingStatus1
-        
-        for charHandle in charHandlerByHandle.keys():
-            await client.start_notify(charHandle, charHandlerByHandle[charHandle])
-            
-        nextPhase = workoutSession.startNextPhase()
-        if nextPhase != None:
-            await programPhase(client, nextPhase);
-
-        window.updateStatus("Start rowing!")
-        window.update()
+    if not client.is_connected:
+        raise ConnectionError("PM5 disconnected during the workout")
 
-        workoutSession.setFuture(newPhase);
-        
-        while not workoutSession.state.isEnded():
-            await newPhase;
-        
-            if newPhase.result() != None:
-                await programPhase(client, newPhase);
+    # Go Idle
+    await sendFrames(csafe, [CSAFE.goIdleFrame])
 
-        # Go Idle
-        await client.write_gatt_char(PM5UUID['sendCSAFE'], frameCSAFE([0x82]), True)
+    postStatus("Disconnecting...")
+    await asyncio.sleep(1)
+    for charHandle in charHandlerByHandle.keys():
+        val = await client.stop_notify(charHandle)
+    await client.stop_notify(PM5UUID['getCSAFE'])
 
-        window.updateStatus("Disconnecting...")
-        window.update()
+
+#
+# Put the screen to sleep
+# Needs 'hdmi_blanking=1' in /boot/config.txt
+#
+def blankScreen():
+    os.system('xset dpms force off')
+
+
+#
+# Wake up a sleeping screen
+#
+def wakeScreen():
+    os.system('xset s reset')
+
+
+#
+# The main program is a single event loop, with one task per subsystem, connected by queues:
+#
+#    MQTT thread --deltas--> bridge --workouts--> rower --activity--> idle manager
+#                                                    \
+#    all subsystems --------------------status------> display
+#
+# so no subsystem can block another.
+#
+statusQueue = None
+
+def postStatus(text, color='black'):
+    statusQueue.put_nowait((text, color))
+
+
+#
+# Display the status messages from all subsystems
+#
+async def displayTask(status):
+    while True:
+        text, color = await status.get()
+        window.updateStatus(text, color)
+
+
+#
+# Turn off the screen if we've been waiting for a workout for a while.
+# Turn it back on when a workout starts.
+#
+async def idleTask(activity):
+    loop    = asyncio.get_running_loop()
+    active  = False
+    blanked = False
+    while True:
+        # Once blanked, wait for the next workout without a timeout
+        timeout = None
+        if not active and not blanked:
+            timeout = 10 * User.secsInOneMin
+        try:
+            active = await asyncio.wait_for(activity.get(), timeout)
+        except asyncio.TimeoutError:
+            await loop.run_in_executor(None, blankScreen)
+            blanked = True
+            continue
+        if active:
+            blanked = False
+            await loop.run_in_executor(None, wakeScreen)
+
+
+#
+# Index and analyze the completed workouts in a worker thread, and show their summary
+#
+async def processLogs():
+    loop = asyncio.get_running_loop()
+    for path in workoutSession.takeClosedLogs():
+        summary = await loop.run_in_executor(None, Workout.processLog, path)
+        if summary is not None:
+            window.showSummary(summary)
+
+
+#
+# Run the requested workouts on the PM-5
+#
+async def rowerTask(workouts, activity):
+    pm5 = Connection.Connection(User.keepPM5Connected)
+    # A PM-5 that drops mid-workout ends the workout, instead of leaving runRower waiting for the next phase
+    pm5.onDisconnect = lambda: workoutSession.commands.put_nowait(None)
+
+    while True:
+        postStatus("Waiting for workout request...")
+
+        if testMode == "Program":
+            workoutSession.createPhases("TestProgram", 30, None)
+        else:
+            await workouts.get()
+        activity.put_nowait(True)
+
+        # Import the plotting modules off the event loop, and build the plots before the notifications start
+        await asyncio.get_running_loop().run_in_executor(None, Display.importPlotting)
+        window.buildPlots()
+
+        postStatus("Connecting to PM5...")
+        rower = await pm5.connect()
+        if rower is None:
+            pm5Log.warning("No PM5 rower found")
+            postStatus("No PM5 rower found", 'red')
+            workoutSession.abort()
+            shadowIoT.gotoIdle()
+            activity.put_nowait(False)
+            continue
+
+        postStatus("Connected", 'green')
+        try:
+            await runRower(rower)
+        except Exception:
+            # Close the session so the next workout can start once the task is restarted
+            workoutSession.abort()
+            raise
+        finally:
+            try:
+                await pm5.release()
+            except Exception as err:
+                pm5Log.warning("Cannot disconnect from PM5: %s", err)
+            if telemetry != None:
+                telemetry.flush()
+            if recorder != None:
+                recorder.flush()
+            shadowIoT.gotoIdle()
+            activity.put_nowait(False)
+            await processLogs()
+
+        postStatus("Workout done.")
+
+
+#
+# Show the latency histograms on the debug overlay (toggled with F2) and dump them periodically
+#
+async def latencyTask():
+    lastDump = time.monotonic()
+    while True:
         await asyncio.sleep(1)
-        for charHandle in charHandlerByHandle.keys():
-            val = await client.stop_notify(charHandle)
+        window.showOverlay(Latency.summary())
+        if time.monotonic() - lastDump >= User.latencyDumpInterval:
+            lastDump = time.monotonic()
+            Logger.get("Latency").info("Latency:\n%s", Latency.summary())
+
+
+#
+# Run a subsystem, restarting it if it fails
+#
+async def supervise(name, subsystem, *args):
+    while True:
+        try:
+            return await subsystem(*args)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            Logger.get(name).exception("%s failed", name)
+            postStatus(name + " failed", 'red')
+            await asyncio.sleep(1)
+
+
+async def supervisor():
+    global statusQueue, shadowIoT
+
+    statusQueue = asyncio.Queue()
+    workouts    = asyncio.Queue()
+    activity    = asyncio.Queue()
+
+    shadowIoT = MyMQTTClient(workoutSession, asyncio.get_running_loop(), telemetry)
+
+    tasks = [supervise("Display", displayTask, statusQueue),
+             supervise("Idle",    idleTask,    activity),
+             supervise("AWS",     shadowIoT.bridge, workouts),
+             supervise("PM5",     rowerTask,   workouts, activity)]
+    if Latency.enabled:
+        tasks.append(supervise("Latency", latencyTask))
+    await asyncio.gather(*tasks)
 
 
 #
@@ -378,10 +580,16 @@ async def runRower(rower):
 #       See if we can get Alexa to say something
 # 
 testMode = None
+recordPath  = None
+replayPath  = None
+replaySpeed = 1
+telemetryTopic = None
+logLevels = dict(User.logLevels)
+Latency.enabled = User.traceLatency
 
 User.defineUser()
 
-for arg in sys.argv:
+for i, arg in enumerate(sys.argv):
     if arg == "-d":
         User.secsInOneMin  = 1
         User.metersInOneKm = 10
@@ -395,82 +603,95 @@ for arg in sys.argv:
     if arg == "-Tp":
         testMode = 'Program'
 
+    # Record the PM-5 notifications to a file
+    if arg == "-r":
+        recordPath = sys.argv[i+1]
+    # Replay recorded notifications, N times faster (0 for as fast as possible)
+    if arg == "-R":
+        replayPath = sys.argv[i+1]
+    if arg == "-x":
+        replaySpeed = float(sys.argv[i+1])
+
+    # Publish live telemetry
+    if arg == "-t":
+        telemetryTopic = "pROWess/" + thingName + "/telemetry"
+
+    # Trace the notification latency
+    if arg == "-L":
+        Latency.enabled = True
+
+    # Log level of a subsystem: -v subsystem[=LEVEL]
+    if arg == "-v":
+        Logger.parseLevel(sys.argv[i+1], logLevels)
+
+Logger.setup(logLevels, User.logPath)
+
+# At the DEBUG level, the raw PM-5 notifications are recorded instead of being dumped as text
+if recordPath == None and pm5Log.isEnabledFor(logging.DEBUG):
+    recordPath = Logger.samplePath
         
 # Wake up a sleeping screen
-os.system('xset s reset')
+wakeScreen()
 
 
 window = Display.MainDisplay(User.screen['X'], User.screen['Y'])
 workoutSession = Workout.Session(window)
 
+# Not used by the test and replay modes, but read by the notification handlers
+recorder  = None
+telemetry = None
+
 if testMode != None and testMode != "Program":
     if testMode == "Time":
         workoutSession.createPhases("Normal", 30, None)
     if testMode == "Distance":
         workoutSession.createPhases("Normal", None, 5000)
         
+    # Let the display refresh while we wait
+    def sleep(secs):
+        window.update()
+        time.sleep(secs)
+
+    # Simulate the PM-5 counters
     interval = 0.5
+    def row(speed, strokeRate, heartRate):
+        sleep(interval)
+        if speed > 0:
+            sample.ElapsedTime += int(interval * 100)
+            sample.Distance    += int(speed * interval * 10)
+        sample.Speed      = int(speed * 1000)
+        sample.StrokeRate = strokeRate
+        sample.HeartBPM   = heartRate
+        workoutSession.update(sample)
+
     for i in range(10):
-        time.sleep(interval)
-        workoutSession.update(0, 0, 10)
+        row(0, 0, 10)
     for i in range(20):
-        time.sleep(interval)
-        workoutSession.update(2, 20, 20)
+        row(2, 20, 20)
     for i in range(6):
-        time.sleep(interval)
-        workoutSession.update(0, 0, 30)
+        row(0, 0, 30)
     for i in range(20):
-        time.sleep(interval)
-        workoutSession.update(2, 20, 40)
+        row(2, 20, 40)
     for i in range(20):
-        time.sleep(interval)
-        workoutSession.update(0, 0, 50)
-    time.sleep(20)
+        row(0, 0, 50)
+    sleep(20)
     exit(0)
 
-shadowIoT = MyMQTTClient(window, workoutSession)
-
-asyncio.set_event_loop_policy(aiotkinter.TkinterEventLoopPolicy())
-loop = asyncio.get_event_loop()
-
-while True:
-    window.updateStatus("Waiting for workout request...")
-    window.update()
-
-    if testMode == "Program":
-        workoutSession.createPhases("TestProgram", 30, None)
-    else:
-        startedWaiting = now()
-        while shadowIoT.isIdle():
-            # Refresh the message every minute
-            if (now() - startedWaiting) % 60 == 0:
-                window.updateStatus("Waiting for workout request...")
-                window.update()
-            # Turn off the screen if we've been waiting for a while
-            if now() - startedWaiting > 10 * User.secsInOneMin:
-                # Put the screen to sleep
-                # Needs 'hdmi_blanking=1' in /boot/config.txt
-                os.system('xset dpms force off')
-                time.sleep(1)
-        
-    # Wake up a sleeping screen
-    os.system('xset s reset')
+if replayPath != None:
+    handlers = {PM5UUID[name]: handler for name, handler in notificationHandlers.items()}
+    count, secs = Replay.Replayer(replayPath).replay(handlers, replaySpeed, window.update)
+    print("Replayed {} notifications in {:.2f} secs ({:.1f} us/notification)".format(count, secs, secs * 1e6 / max(count, 1)))
+    exit(0)
 
-    window.updateStatus("Connecting to PM5...")
-    window.update()
+if recordPath != None:
+    recorder = Replay.Recorder(recordPath)
 
-    rower = loop.run_until_complete(findRower())
-    if rower is None:
-        print("No PM5 rower found")
-        window.updateStatus("No PM5 rower found", 'red')
-        window.update()
-        continue
+if telemetryTopic != None:
+    os.makedirs(os.path.expanduser("~/.pROWess"), exist_ok=True)
+    telemetry = Telemetry.Publisher(telemetryTopic, os.path.expanduser("~/.pROWess/telemetry.spool"))
 
-    window.updateStatus("Connected", 'green')
-    window.update()
+shadowIoT = None
 
-    loop.run_until_complete(runRower(rower))
-    shadowIoT.gotoIdle()
-    
-    window.updateStatus("Workout done.")
-    window.update()
+# The Tk display is serviced by the event loop
+asyncio.set_event_loop_policy(aiotkinter.TkinterEventLoopPolicy())
+asyncio.run(supervisor())
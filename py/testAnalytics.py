@@ -0,0 +1,76 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import tempfile
+
+import Analytics
+import History
+import Logbook
+import PM5
+import User
+
+
+def close(a, b):
+    return abs(a - b) < 1e-6
+
+
+# Concept2 reference: a 2:00 /500m pace is 202.5 W
+assert abs(Analytics.watts(120) - 202.5) < 0.1
+
+#
+# Log a 2000m session at a steady 2:05 pace, in two phases (the PM-5 counters restart)
+#
+logDir = tempfile.mkdtemp()
+writer = Logbook.Writer(logDir, {'intensity': "Normal", 'duration': None, 'distance': 2000})
+
+sample = PM5.Sample()
+sample.Pace       = 12500
+sample.StrokeRate = 24
+sample.HeartBPM   = 150
+for n in (301, 201):
+    for i in range(n):
+        sample.ElapsedTime = i * 100
+        sample.Distance    = i * 40
+        writer.append(sample)
+writer.close()
+
+result = Analytics.analyze(writer.path)
+assert result['samples'] == 502
+assert close(result['totalTime'], 500)
+assert close(result['totalDistance'], 2000)
+assert all(close(t, 125) for t in result['splits']), result['splits']
+assert close(result['avgPace'], 125)
+assert close(result['paceVariability'], 0)
+assert abs(result['paceDrift']) < 1e-6
+assert close(result['avgWatts'], Analytics.watts(125))
+
+# Must agree with the scalar aggregates indexed in the history
+session = Logbook.Reader(writer.path)
+summary, splits, bests = History.summarize(session)
+session.close()
+assert len(splits) == len(result['splits'])
+assert all(close(a, b) for a, b in zip(splits, result['splits']))
+
+# All the rowing time is spent in a single zone
+zone = sum([24 >= z for z in Analytics.strokeRateZones])
+assert close(result['strokeRateZones'][zone], 500)
+assert close(sum(result['strokeRateZones']), 500)
+zone = sum([150 >= z for z in Analytics.heartRateZones * User.maxHeartRate])
+assert close(result['heartRateZones'][zone], 500)
+
+assert len(Analytics.analyzeAll(logDir)) == 1
+
+print("PASS")
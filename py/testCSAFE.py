@@ -0,0 +1,168 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import asyncio
+
+import CSAFE
+
+
+#
+# Reference framing, straight from the CSAFE specification
+#
+def reference(commands):
+    checksum = 0
+    for b in commands:
+        checksum ^= b
+    frame = [CSAFE.startFlag]
+    for b in list(commands) + [checksum]:
+        if 0xF0 <= b <= 0xF3:
+            frame += [CSAFE.stuffFlag, b - 0xF0]
+        else:
+            frame.append(b)
+    frame.append(CSAFE.stopFlag)
+    return bytes(frame)
+
+
+assert CSAFE.goReadyFrame == bytes([0xF1, 0x87, 0x87, 0xF2])
+assert CSAFE.goIdleFrame  == bytes([0xF1, 0x82, 0x82, 0xF2])
+assert CSAFE.goInUseFrame == bytes([0xF1, 0x85, 0x85, 0xF2])
+
+# Commands
+assert CSAFE.setTWork(3723)          == bytes([0x20, 0x03, 1, 2, 3])
+assert CSAFE.setHorizontal(2000)     == bytes([0x21, 0x03, 0xD0, 0x07, 0x24])
+assert CSAFE.setProgram(0)           == bytes([0x24, 0x02, 0x00, 0x00])
+assert CSAFE.setSplitDuration(secs=120)     == bytes([0x1A, 0x07, 0x05, 0x05, 0x00, 0xE0, 0x2E, 0x00, 0x00])
+assert CSAFE.setSplitDuration(meters=500)   == bytes([0x1A, 0x07, 0x05, 0x05, 0x80, 0xF4, 0x01, 0x00, 0x00])
+try:
+    CSAFE.command(CSAFE.GOREADY, b'\x00')
+    assert False
+except ValueError:
+    pass
+
+# Byte-stuffing, with the checksum over the unstuffed bytes
+for commands in (CSAFE.setSplitDuration(meters=500),    # 0xF4 is not stuffed
+                 CSAFE.setHorizontal(0xF1F2),           # Stuffed data
+                 bytes([0x21, 0x03, 0x00, 0x00, 0xD2]),  # Stuffed checksum
+                 bytes(range(0x80))):
+    assert CSAFE.frame(commands) == reference(commands), CSAFE.frame(commands).hex()
+frame = CSAFE.frame(CSAFE.setHorizontal(0xF1F2))
+assert 0xF1 not in frame[1:-1] and 0xF2 not in frame[1:-1]
+
+# Packing in BLE writes
+commands = [CSAFE.command(CSAFE.GOREADY), CSAFE.setTWork(30 * 60), CSAFE.setSplitDuration(secs=6 * 60),
+            CSAFE.setProgram(0), CSAFE.command(CSAFE.GOINUSE)]
+frames = CSAFE.pack(commands)
+assert len(frames) == 2
+assert all(len(frame) <= CSAFE.maxWriteSize for frame in frames)
+assert frames[0] == reference(b''.join(commands[:3])) and frames[1] == reference(b''.join(commands[3:]))
+assert CSAFE.pack(commands, 100) == [reference(b''.join(commands))]
+
+
+#
+# Response parsing
+#
+serial   = bytes([CSAFE.GETSERIAL, 9]) + b"430123456"
+drag     = bytes([CSAFE.SETUSERCFG1, 3, CSAFE.PM_GET_DRAGFACTOR, 1, 0xF2])
+response = reference(bytes([0x81]) + serial + drag)
+
+parser = CSAFE.Parser()
+frames = []
+for i in range(0, len(response), 7):
+    frames += parser.feed(response[i:i+7])
+assert len(frames) == 1
+rsp = CSAFE.parseResponse(frames[0])
+assert rsp.status == 0x81 and rsp.state() == 1
+assert rsp[CSAFE.GETSERIAL] == b"430123456"
+assert rsp[CSAFE.PM_GET_DRAGFACTOR] == bytes([0xF2])
+
+# Leading garbage, bad checksum, and two frames in one notification
+bad = bytearray(reference(bytes([0x81]) + serial))
+bad[3] ^= 0x01
+frames = parser.feed(b"\x00\x55" + bytes(bad) + response + response[:5])
+assert len(frames) == 1 and parser.errors == 1
+frames = parser.feed(response[5:])
+assert len(frames) == 1 and CSAFE.parseResponse(frames[0])[CSAFE.GETSERIAL] == b"430123456"
+assert len(parser.buffer) == 0
+
+
+#
+# Workout phases
+#
+timed = CSAFE.phaseFrames({'name': "Timed", 'duration': 2, 'restTime': 0, 'repeat': 1})
+assert timed == CSAFE.pack([CSAFE.command(CSAFE.GOREADY), CSAFE.setTWork(120), CSAFE.setSplitDuration(secs=120),
+                            CSAFE.setProgram(0), CSAFE.command(CSAFE.GOINUSE)])
+race = CSAFE.phaseFrames({'name': "Race", 'distance': 2000, 'restTime': 0, 'repeat': 1})
+assert race == CSAFE.pack([CSAFE.command(CSAFE.GOREADY), CSAFE.setHorizontal(2000), CSAFE.setSplitDuration(meters=2000),
+                           CSAFE.setProgram(0), CSAFE.command(CSAFE.GOINUSE)])
+# A free phase (just row, scheduled) has no goal to program
+free = CSAFE.phaseFrames({'name': "Normal Row", 'restTime': 0, 'repeat': 1})
+assert free == [CSAFE.frame(CSAFE.command(CSAFE.GOREADY) + CSAFE.command(CSAFE.GOINUSE))]
+assert CSAFE.phaseFrames({'name': "Old", 'duration': None, 'distance': None, 'restTime': 0, 'repeat': 1}) == free
+
+#
+# Request/response correlation, with a simulated PM-5 responding in 20-byte notifications
+#
+async def main():
+    written = []
+    async def write(frame):
+        written.append(frame)
+        status = bytes([0x01])
+        if frame == CSAFE.frame(CSAFE.pmCommand(CSAFE.PM_GET_DRAGFACTOR)):
+            rsp = reference(status + bytes([CSAFE.SETUSERCFG1, 3, CSAFE.PM_GET_DRAGFACTOR, 1, 118]))
+        elif frame == CSAFE.frame(CSAFE.command(CSAFE.GETSERIAL)):
+            rsp = reference(status + serial)
+        else:
+            return
+        loop = asyncio.get_running_loop()
+        for i in range(0, len(rsp), 20):
+            loop.call_soon(requester.notify, 0x22, rsp[i:i+20])
+
+    requester = CSAFE.Requester(write, timeout=0.1)
+    serialNo, dragFactor = await asyncio.gather(requester.getSerial(), requester.getDragFactor())
+    assert serialNo == "430123456" and dragFactor == 118
+    assert len(written) == 2
+
+    # No response
+    try:
+        await requester.send(CSAFE.goIdleFrame)
+        assert False
+    except asyncio.TimeoutError:
+        pass
+    assert len(requester.pending) == 0
+
+    # A late response to a request that timed out does not resolve the next request
+    lateSerial = reference(bytes([0x01]) + serial)
+    original = write
+    async def slowWrite(frame):
+        if frame == CSAFE.frame(CSAFE.command(CSAFE.GETSERIAL)):
+            return
+        await original(frame)
+    requester.write = slowWrite
+    try:
+        await requester.getSerial()
+        assert False
+    except asyncio.TimeoutError:
+        pass
+    async def lateWrite(frame):
+        requester.notify(0x22, lateSerial)
+        await original(frame)
+    requester.write = lateWrite
+    assert await requester.getDragFactor() == 118
+    assert requester.dropped == 1
+
+asyncio.run(main())
+
+print("PASS")
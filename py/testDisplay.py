@@ -32,13 +32,18 @@ data = [[21, 2570, 72],
         [21, 2570, 72]]
 
 
+elapsedTime = 0
+distance    = 0
+
 def test():
-    global window
+    global window, elapsedTime, distance
     if len(data) == 0:
         return
 
+    elapsedTime += 1
+    distance    += data[0][1]/1000
     window.updateStrokeRate(data[0][0])
-    window.updateSpeed(data[0][1]/1000)
+    window.updateProgress(elapsedTime, distance, data[0][1]/1000)
     window.updateHeartBeat(data[0][2])
 
     data.pop(0)
@@ -0,0 +1,82 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import logging
+import random
+
+logging.getLogger().addHandler(logging.NullHandler())
+
+from lambda_function import ISO8601_to_secs, durationUnits
+
+
+#
+# Values Alexa produces for AMAZON.DURATION
+#
+assert ISO8601_to_secs("PT30M")     == 30 * 60
+assert ISO8601_to_secs("PT1H30M")   == 90 * 60
+assert ISO8601_to_secs("PT1H30M5S") == 90 * 60 + 5
+assert ISO8601_to_secs("PT90S")     == 90
+assert ISO8601_to_secs("PT0.5H")    == 30 * 60
+assert ISO8601_to_secs("P1D")       == 86400
+assert ISO8601_to_secs("P2W")       == 14 * 86400
+assert ISO8601_to_secs("P1DT12H")   == 36 * 3600
+for invalid in ("", "P", "PT", "P1DT", "PT1H30", "T30M", "PT30m", "PT1S1M", "PT-1M", "P1H", "PT1.M", "30 minutes"):
+    assert ISO8601_to_secs(invalid) is None, invalid
+
+#
+# Property: any combination of components, integer or with a fraction, parses to the sum of its components
+#
+random.seed(1)
+designators = ('Y', 'M', 'W', 'D', 'H', 'M', 'S')
+for i in range(20000):
+    duration = "P"
+    expected = 0
+    for n, (designator, unit) in enumerate(zip(designators, durationUnits)):
+        if n == 4:
+            separator = "T"
+        if random.random() < 0.5:
+            continue
+        if random.random() < 0.2:
+            value = "{}{}{}".format(random.randint(0, 99), random.choice(".,"), random.randint(0, 999))
+        else:
+            value = str(random.randint(0, 9999))
+        expected += float(value.replace(',', '.')) * unit
+        if n >= 4 and separator:
+            duration += separator
+            separator = ""
+        duration += value + designator
+    secs = ISO8601_to_secs(duration)
+    if duration == "P":
+        assert secs is None
+    else:
+        assert secs is not None and abs(secs - expected) <= 1e-9 * max(1, expected), (duration, secs, expected)
+
+#
+# Property: deleting or duplicating a character of a valid duration never raises
+#
+for i in range(20000):
+    duration = random.choice(("PT30M", "PT1H30M5S", "P1DT12H", "PT0.5H", "P2W"))
+    pos = random.randrange(len(duration))
+    mutated = duration[:pos] + random.choice(("", duration[pos] * 2, random.choice("PTYMWDHS.,0123456789x"))) + duration[pos+1:]
+    secs = ISO8601_to_secs(mutated)
+    assert secs is None or secs >= 0
+
+#
+# The cache is bounded
+#
+assert ISO8601_to_secs.cache_info().currsize <= ISO8601_to_secs.cache_info().maxsize
+
+print("PASS")
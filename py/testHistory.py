@@ -0,0 +1,91 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import tempfile
+
+import History
+import Logbook
+import PM5
+
+#
+# Log a session
+#
+logDir = tempfile.mkdtemp()
+writer = Logbook.Writer(logDir, {'intensity': "Normal", 'duration': 30, 'distance': None})
+
+sample = PM5.Sample()
+for i in range(10):
+    sample.ElapsedTime = i * 50
+    sample.Distance    = i * 12
+    writer.append(sample, writer.start + i * 0.5)
+writer.close()
+
+#
+# Index it in the workout history, only once
+#
+history = History.History(os.path.join(logDir, "history.db"))
+history.update(logDir)
+history.update(logDir)
+assert history.db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] == 1
+assert history.weeklyMeters()[0][1] == 10.8
+assert history.averagePace("Normal", 30, None) == 4.5 * 500 / 10.8
+
+# Adding a session that is already indexed does nothing
+history.add(writer.path)
+assert history.db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] == 1
+history.close()
+
+#
+# Best times over the standard distances, and best split, across sessions
+#
+def logRow(logDir, paces):
+    writer = Logbook.Writer(logDir, {'intensity': "Intense", 'duration': None, 'distance': 3000})
+    sample = PM5.Sample()
+    sample.ElapsedTime = 0
+    sample.Distance    = 0
+    writer.append(sample)
+    # (meters, speed in m/s): one sample per second
+    for meters, speed in paces:
+        for i in range(int(meters / speed)):
+            sample.ElapsedTime += 100
+            sample.Distance    += int(speed * 10)
+            writer.append(sample)
+    writer.close()
+    return writer.path
+
+logDir = tempfile.mkdtemp()
+history = History.History(os.path.join(logDir, "history.db"))
+
+# 2500 m at 2 m/s: 250 s per 500 m
+history.add(logRow(logDir, [(2500, 2)]))
+assert history.best(500)[0]  == 250
+assert history.best(2000)[0] == 1000
+assert history.best(5000) is None
+assert history.bestSplit()[0] == 250
+
+# 3000 m: 1500 m at 2 m/s then 1500 m at 2.5 m/s (200 s per 500 m)
+history.add(logRow(logDir, [(1500, 2), (1500, 2.5)]))
+assert history.best(500)[0]  == 200
+assert history.best(1000)[0] == 400
+# The best 2000 m must include the last 500 m rowed at 2 m/s
+assert history.best(2000)[0] == 500 / 2 + 1500 / 2.5
+assert history.bestSplit()[0] == 200
+assert history.db.execute("SELECT COUNT(*) FROM splits").fetchone()[0] == 5 + 6
+
+history.close()
+
+print("PASS")
@@ -0,0 +1,62 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import random
+
+import Latency
+
+
+#
+# Histogram precision
+#
+random.seed(1)
+h = Latency.Histogram()
+values = sorted([int(random.lognormvariate(12, 2)) for i in range(10000)] + [0, 1, 31, 32, 1 << 45])
+for value in values:
+    h.record(value)
+assert h.count == len(values)
+assert h.min == 0 and h.max == (1 << Latency.Histogram.maxBits) - 1
+for p in (1, 50, 90, 99):
+    exact = values[-(-len(values) * p // 100) - 1]
+    assert exact <= h.percentile(p) <= exact * 1.0625 + 1, (p, exact, h.percentile(p))
+for value in range(5000):
+    idx = h.bucket(value)
+    assert h.highest(idx) >= value and (idx == 0 or h.highest(idx - 1) < value)
+
+#
+# Trace points
+#
+Latency.enabled = False
+assert Latency.notified() == 0
+assert Latency.stage('decode', 0) == 0
+Latency.rendered(Latency.start())
+assert len(Latency.histograms) == 0
+
+Latency.enabled = True
+for i in range(3):
+    t0 = Latency.notified()
+    t1 = Latency.stage('decode', t0)
+    Latency.stage('notify', t0)
+Latency.rendered(Latency.start())
+assert Latency.histograms['interval'].count == 2
+assert Latency.histograms['decode'].count == 3
+assert Latency.histograms['pixels'].count == 1
+assert "pixels" in Latency.summary()
+
+Latency.reset()
+assert Latency.histograms['decode'].count == 0
+
+print("PASS")
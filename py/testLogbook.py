@@ -0,0 +1,89 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import tempfile
+
+import Logbook
+import PM5
+
+#
+# Log a session, then read it back
+#
+logDir = tempfile.mkdtemp()
+writer = Logbook.Writer(logDir, {'intensity': "Normal", 'duration': 30, 'distance': None}, flushEvery=4)
+
+sample = PM5.Sample()
+for i in range(10):
+    sample.ElapsedTime = i * 50
+    sample.Distance    = i * 12
+    sample.HeartBPM    = 100 + i
+    writer.append(sample, writer.start + i * 0.5)
+writer.flush()
+
+# Simulate a power loss in the middle of writing a value
+distance = Logbook.columnPath(writer.path, 'Distance')
+os.truncate(distance, os.path.getsize(distance) - 1)
+
+session = Logbook.Reader(writer.path)
+assert len(session) == 9
+assert session.meta['intensity'] == "Normal"
+assert not session.meta['closed']
+assert list(session['Time'])     == [i * 500 for i in range(9)]
+assert list(session['Distance']) == [i * 12 for i in range(9)]
+assert list(session['HeartBPM']) == [100 + i for i in range(9)]
+session.close()
+
+writer.close({'totalDistance': 108})
+session = Logbook.Reader(writer.path)
+assert session.meta['closed']
+assert session.meta['samples'] == 10
+assert session.meta['totalDistance'] == 108
+session.close()
+
+assert Logbook.sessions(logDir) == [writer.path]
+
+#
+# Strokes and force curves
+#
+first  = writer.path
+writer = Logbook.Writer(logDir, {'intensity': "Easy", 'duration': None, 'distance': 2000}, flushEvery=4)
+# A new session never reuses the directory of another, even if started within the same second
+assert writer.path != first
+for i in range(6):
+    sample.ElapsedTime = i * 250
+    sample.StrokeCount = i
+    sample.PeakForce   = 1500 + i
+    writer.appendStroke(sample, writer.start + i * 2.5)
+    writer.appendForceCurve([100 * i + n for n in range(10 + i)], writer.start + i * 2.5 + 0.1)
+    writer.append(sample, writer.start + i * 2.5)
+writer.close()
+
+# Lose the end of the last force curve
+forces = Logbook.columnPath(writer.path, 'Forces', 'curves')
+os.truncate(forces, os.path.getsize(forces) - 2)
+
+session = Logbook.Reader(writer.path)
+assert session.strokeCount == 6
+assert list(session.strokes['StrokeCount']) == list(range(6))
+assert list(session.strokes['PeakForce'])   == [1500 + i for i in range(6)]
+assert list(session.strokes['Time'])        == [i * 2500 for i in range(6)]
+assert session.curveCount == 5
+assert session.curve(3) == [300 + n for n in range(13)]
+session.close()
+assert Logbook.sessions(logDir) == [first, writer.path]
+
+print("PASS")
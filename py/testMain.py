@@ -26,6 +26,7 @@ import time
 import uuid
 
 import User
+import PM5
 import Workout
 import Display
 
@@ -59,19 +60,25 @@ if testMode == "Distance":
 workoutSession.startSplits()
 
 interval = 0.5
-for i in range(10):
+sample = PM5.Sample()
+def row(speed, strokeRate, heartRate):
     time.sleep(interval)
-    workoutSession.update(0, 0, 78)
+    if speed > 0:
+        sample.ElapsedTime += int(interval * 100)
+        sample.Distance    += int(speed * interval * 10)
+    sample.Speed      = int(speed * 1000)
+    sample.StrokeRate = strokeRate
+    sample.HeartBPM   = heartRate
+    workoutSession.update(sample)
+
+for i in range(10):
+    row(0, 0, 78)
 for i in range(20):
-    time.sleep(interval)
-    workoutSession.update(2, 20, 90)
+    row(2, 20, 90)
 for i in range(6):
-    time.sleep(interval)
-    workoutSession.update(0, 0, 85)
+    row(0, 0, 85)
 for i in range(20):
-    time.sleep(interval)
-    workoutSession.update(2, 20, 90)
+    row(2, 20, 90)
 for i in range(20):
-    time.sleep(interval)
-    workoutSession.update(0, 0, 80)
+    row(0, 0, 80)
 time.sleep(20)
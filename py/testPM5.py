@@ -0,0 +1,66 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import PM5
+from PM5 import PM5UUID
+
+#
+# Check the PM-5 notification decoders against hand-assembled notifications
+#
+rowStatus1 = bytearray([0x40, 0xE2, 0x01,     # ElapsedTime = 123456
+                        0x80, 0x0D,           # Speed       = 3456
+                        24,                   # StrokeRate
+                        142,                  # HeartBPM
+                        0x83, 0x38,           # Pace        = 14467
+                        0x84, 0x38,           # AvgPace     = 14468
+                        0x10, 0x00,           # RestDist    = 16
+                        0x01, 0x00, 0x02,     # RestTime    = 131073
+                        0x00])                # MachineType
+
+sample = PM5.Sample()
+PM5.decoders[PM5UUID['RowStatus1']].decode(rowStatus1, sample)
+
+assert sample.ElapsedTime == 123456
+assert sample.Speed       == 3456
+assert sample.StrokeRate  == 24
+assert sample.HeartBPM    == 142
+assert sample.Pace        == 14467
+assert sample.AvgPace     == 14468
+assert sample.RestDist    == 16
+assert sample.RestTime    == 131073
+
+for charUUID, decoder in PM5.decoders.items():
+    sample = PM5.Sample()
+    for i, (name, nBytes) in enumerate(decoder.fields):
+        setattr(sample, name, (i * 0x010203) & ((1 << (8 * nBytes)) - 1))
+    val = decoder.encode(sample)
+    assert len(val) == decoder.size
+
+    decoded = decoder.decode(val, PM5.Sample())
+    for name, nBytes in decoder.fields:
+        assert getattr(decoded, name) == getattr(sample, name), (charUUID, name)
+
+#
+# A force curve split across two notifications
+#
+curve = PM5.ForceCurve()
+assert not curve.add(bytearray([0x23, 0, 10, 0, 20, 0, 30, 0]))
+assert curve.add(bytearray([0x22, 1, 40, 0, 0x2C, 0x01]))
+assert curve.values() == [10, 20, 30, 40, 300]
+assert curve.add(bytearray([0x11, 2, 5, 0]))
+assert curve.values() == [5]
+
+print("PASS")
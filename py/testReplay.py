@@ -0,0 +1,57 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import tempfile
+
+import PM5
+import Replay
+from PM5 import PM5UUID
+
+#
+# Record a few notifications then replay them as fast as possible
+#
+path = os.path.join(tempfile.mkdtemp(), "test.rec")
+
+recorder = Replay.Recorder(path)
+recorder.record(PM5UUID['RowStatus1'], bytes(range(17)), 1000000000)
+recorder.record(PM5UUID['RowStatus'],  bytes(range(19)), 1250000000)
+recorder.record(PM5UUID['RowStatus1'], bytes(range(1, 18)), 1500000000)
+recorder.close()
+
+assert os.path.getsize(path) == len(Replay.MAGIC) + 3 * Replay.record.size + 17 + 19 + 17
+
+records = [(when, charUUID, bytes(val)) for when, charUUID, val in Replay.Replayer(path)]
+assert records == [(0,      PM5UUID['RowStatus1'], bytes(range(17))),
+                   (250000, PM5UUID['RowStatus'],  bytes(range(19))),
+                   (500000, PM5UUID['RowStatus1'], bytes(range(1, 18)))]
+
+received = []
+count, secs = Replay.Replayer(path).replay({PM5UUID['RowStatus1']: lambda charHandle, val: received.append(charHandle)}, 0)
+assert count == 2
+assert received == [0x0032, 0x0032]
+
+#
+# Convert the printed stats in testdata.log
+#
+Replay.fromStatsLog(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "testdata.log"), path)
+sample = PM5.Sample()
+decoders = PM5.decoders
+for when, charUUID, val in Replay.Replayer(path):
+    decoders[charUUID].decode(val, sample)
+assert sample.ElapsedTime > 0
+
+print("PASS")
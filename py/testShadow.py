@@ -0,0 +1,91 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import threading
+
+import Shadow
+
+
+#
+# Shadow handler that accepts or rejects the updates, and records them
+#
+class Handler:
+
+    def __init__(self):
+        self.updates = []
+        self.reject  = 0
+        self.sent    = threading.Semaphore(0)
+
+    def shadowUpdate(self, payload, callback, timeout):
+        status = "accepted"
+        if self.reject > 0:
+            self.reject -= 1
+            status = "rejected"
+        else:
+            self.updates.append(json.loads(payload))
+        callback(payload, status, None)
+        self.sent.release()
+
+
+def waitFor(handler, n):
+    for i in range(n):
+        assert handler.sent.acquire(timeout=5)
+
+
+reporter = Shadow.ShadowReporter(minBackoff=0.01)
+handler  = Handler()
+reporter.setHandler(handler)
+
+#
+# The whole state is reported first, then only what changed. The desired state is never echoed.
+#
+reporter.report({'intensity': "Idle", 'duration': None, 'distance': None}, clearDesired=True)
+waitFor(handler, 1)
+assert handler.updates[-1] == {'state': {'reported': {'intensity': "Idle", 'duration': None, 'distance': None},
+                                         'desired': None}}
+
+reporter.report({'intensity': "Normal", 'duration': 30, 'distance': None})
+waitFor(handler, 1)
+assert handler.updates[-1] == {'state': {'reported': {'intensity': "Normal", 'duration': 30}}}
+
+#
+# Nothing is sent when nothing changed
+#
+reporter.report({'intensity': "Normal", 'duration': 30, 'distance': None})
+reporter.report({'intensity': "Idle", 'duration': None, 'distance': None}, clearDesired=True)
+waitFor(handler, 1)
+assert len(handler.updates) == 3
+assert handler.updates[-1] == {'state': {'reported': {'intensity': "Idle", 'duration': None}, 'desired': None}}
+
+#
+# A rejected update is retried, still clearing the desired state even if replaced in the meantime
+#
+handler.reject = 1
+reporter.report({'intensity': "Easy", 'duration': None, 'distance': 2000}, clearDesired=True)
+waitFor(handler, 2)
+assert handler.updates[-1] == {'state': {'reported': {'intensity': "Easy", 'distance': 2000}, 'desired': None}}
+
+#
+# The whole state is reported again on a new connection
+#
+handler = Handler()
+reporter.setHandler(handler)
+reporter.report({'intensity': "Easy", 'duration': None, 'distance': 2000})
+waitFor(handler, 1)
+assert handler.updates[-1] == {'state': {'reported': {'intensity': "Easy", 'duration': None, 'distance': 2000}}}
+
+print("PASS")
@@ -0,0 +1,88 @@
+#
+# Copyright 2021  Janick Bergeron <janick@bergeron.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import tempfile
+import time
+
+import PM5
+import Telemetry
+
+
+#
+# Local stand-in for the MQTT broker connection
+#
+class Broker:
+    def __init__(self):
+        self.online   = True
+        self.messages = []
+
+    def publish(self, topic, payload, qos):
+        if not self.online:
+            return False
+        self.messages.append((topic, payload))
+        return True
+
+    def waitFor(self, n):
+        deadline = time.monotonic() + 5
+        while len(self.messages) < n and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(self.messages) == n, self.messages
+
+
+spoolPath = os.path.join(tempfile.mkdtemp(), "telemetry.spool")
+broker    = Broker()
+publisher = Telemetry.Publisher("test/telemetry", spoolPath, maxSamples=4, maxInterval=0.5)
+publisher.setConnection(broker)
+
+sample = PM5.Sample()
+def stroke(n):
+    sample.StrokeCount = n
+    sample.ElapsedTime = n * 250
+    sample.HeartBPM    = 120 + n
+    publisher.add(sample)
+
+
+# A full batch is published right away
+for n in range(4):
+    stroke(n)
+broker.waitFor(1)
+topic, payload = broker.messages[0]
+assert topic == "test/telemetry"
+assert len(payload) == Telemetry.header.size + 4 * Telemetry.record.size
+assert [r['StrokeCount'] for r in Telemetry.decode(payload)] == [0, 1, 2, 3]
+assert Telemetry.decode(payload)[3]['HeartBPM'] == 123
+
+# A partial batch is published after the interval
+stroke(4)
+broker.waitFor(2)
+assert [r['StrokeCount'] for r in Telemetry.decode(broker.messages[1][1])] == [4]
+
+# Offline: batches are spooled, then published in order once back online
+broker.online = False
+for n in range(5, 13):
+    stroke(n)
+time.sleep(0.2)
+assert os.path.exists(spoolPath)
+assert len(broker.messages) == 2
+
+broker.online = True
+stroke(13)
+broker.waitFor(5)
+assert [r['StrokeCount'] for topic, payload in broker.messages[2:] for r in Telemetry.decode(payload)] == list(range(5, 14))
+assert not os.path.exists(spoolPath)
+
+print("PASS")